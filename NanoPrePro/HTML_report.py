@@ -2,7 +2,6 @@ from importlib import resources as impresources
 from . import templates
 from plotly.subplots import make_subplots
 import plotly.graph_objects as go
-import plotly.express as px
 import pandas as pd
 import numpy as np
 import sys
@@ -20,6 +19,11 @@ class HTML_report:
         return
     
     def update_optimized_data(self, data, n_iqr, palette={"positive": "blue", "negative": "orange"}):
+        # no optimization (--beta 0)
+        if data is None:
+            self.template = self.template.replace("%(plot)", "<p>Not optimized (--beta 0).</p>")
+            return
+
         # 1. Preprocess optimization data
         # one alignment one row --> record counts of identical alignment results
         data_agg = data.groupby(["pid","loc","cls","plen","site"]).size().reset_index(name="count")
@@ -160,16 +164,34 @@ class HTML_report:
         self.template = self.template.replace("%(params)", params)
         return
     
-    def update_stats(self, report_dict, meanq_list):
-        df = pd.DataFrame({"Average Q-scores": meanq_list})
-        fig_meanq = px.histogram(df, x="Average Q-scores")
-        fig_meanq.update_layout(
-            template="plotly_white",
-            xaxis_title_standoff=0,
-            yaxis_title_standoff=0,
-            yaxis_title="Counts",
-        )
-        
+    def update_stats(self, report_dict, stats):
+        # mean Q-score histogram (see `Histogram`)
+        left, right, counts = stats["meanq"].bins()
+        fig_meanq = go.Figure(go.Bar(
+            x=(left + right) / 2,
+            y=counts,
+            width=right - left,
+            name="Average Q-scores",
+            hovertemplate="Average Q-score: %{x:.1f}<br>Counts: %{y}<extra></extra>"
+        ))
+
+        # read length and adapter/primer location histograms (log-spaced bins)
+        fig_length = go.Figure()
+        for key, name in [
+            ("length", "Read length"),
+            ("loc5", "5' AP location"),
+            ("loc3", "3' AP location")
+        ]:
+            left, right, counts = stats[key].bins()
+            fig_length.add_trace(go.Scatter(
+                x=np.append(left, right[-1]),
+                y=np.append(counts, counts[-1]),
+                mode="lines",
+                line_shape="hv",
+                name=name,
+                visible=True if key == "length" else "legendonly"
+            ))
+
         # -----------------------------
         # Create pie chart for stats
         # -----------------------------
@@ -200,10 +222,17 @@ class HTML_report:
         # Combine into 1x2 subplot
         # -----------------------------
         fig_combined = make_subplots(
-            rows=1, cols=2,
+            rows=2, cols=2,
             column_widths=[0.7, 0.3],
-            specs=[[{"type": "xy"}, {"type": "domain"}]],  # histogram + pie
-            subplot_titles=("Average Q-score of input reads", "Read classification")
+            specs=[
+                [{"type": "xy"}, {"type": "domain"}],  # histogram + pie
+                [{"type": "xy", "colspan": 2}, None]  # length histograms
+            ],
+            subplot_titles=(
+                "Average Q-score of input reads", "Read classification",
+                "Read length / AP location (<i>n</i>-bp from read termini)"
+            ),
+            vertical_spacing=0.15
         )
 
         # Add mean Q-score histogram to left subplot
@@ -214,16 +243,46 @@ class HTML_report:
         for trace in fig_pie.data:
             fig_combined.add_trace(trace, row=1, col=2)
 
+        # Add read length/AP location histograms to the bottom subplot
+        for trace in fig_length.data:
+            fig_combined.add_trace(trace, row=2, col=1)
+
         # Update layout
         fig_combined.update_layout(
             template="plotly_white",
-            width=1000, height=400,
+            width=1000, height=800,
             showlegend=True,
             hovermode="x",
         )
-                    
+        fig_combined.update_xaxes(title_text="Average Q-score", title_standoff=0, row=1, col=1)
+        fig_combined.update_yaxes(title_text="Counts", title_standoff=0, row=1, col=1)
+        fig_combined.update_xaxes(type="log", title_text="bp", title_standoff=0, row=2, col=1)
+        fig_combined.update_yaxes(title_text="Counts", title_standoff=0, row=2, col=1)
+
+        # Quantiles of the statistics
+        qs = [0.05, 0.25, 0.5, 0.75, 0.95]
+        summary = "%-16s%12s%10s" % ("", "count", "mean") + \
+            "".join("%10s" % f"Q{int(q * 100)}" for q in qs) + "\n"
+        for key, name in [
+            ("meanq", "Average Q-score"),
+            ("length", "Read length"),
+            ("loc5", "5' AP location"),
+            ("loc3", "3' AP location")
+        ]:
+            summary += "%-16s%12d%10.1f" % (name, len(stats[key]), stats[key].mean()) + \
+                "".join("%10.1f" % x for x in stats[key].quantile(qs)) + "\n"
+        summary += "\n5'/3' alignments: %d run, %d skipped by the seed filter\n" % (
+            report_dict["ends/aligned"], report_dict["ends/skipped"]
+        )
+        summary += "Reads not checked for fusion: %d full-length, %d truncated\n" % (
+            report_dict["unchecked/full-length"], report_dict["unchecked/truncated"]
+        )
+
         # Convert to HTML string
-        self.template = self.template.replace("%(meanq)", fig_combined.to_html())
+        self.template = self.template.replace(
+            "%(meanq)",
+            fig_combined.to_html() + f'\n<div class="code-block">{summary}</div>'
+        )
         return
             
     # def update_qplot(self, meanq_list):
@@ -1,22 +1,26 @@
 from NanoPrePro.preptools.Annotator import Annotator
 from NanoPrePro.preptools.Processor import Processor
 from NanoPrePro.seqtools.FastqIO import FastqIO, FastqIndexIO
-from NanoPrePro.seqtools.SeqFastq import SeqFastq
+from NanoPrePro.seqtools.Histogram import Histogram
 # from NanoPreP.paramtools.paramsets import Params, Defaults
-from NanoPrePro.paramtools.argParser import parser
+from NanoPrePro.paramtools.argParser import parser, fetch_parser
 from NanoPrePro.preptools.Optimizer import Optimizer
 from NanoPrePro.HTML_report import HTML_report
 from datetime import datetime
 from pathlib import Path
+from collections import deque
 import numpy as np
 import multiprocessing as mp
-import os, sys, json, gzip, random, logging
+import os, sys, json, gzip, random, logging, shutil, tempfile
 
 # TODO: 1. test for the number of reads to sample for optimization
 
 # initiate global variable `PARAMS`
 PARAMS = {}
 
+# size (bytes) of the buffers workers send to `fq_writer`
+WRITER_BUFFER_SIZE = 1 << 22
+
 # set logging style
 logging.basicConfig(
     format="[%(asctime)s] PID=%(process)d: %(message)s",
@@ -27,13 +31,51 @@ logging.basicConfig(
 
 # main function
 def main():
+    # subcommands
+    if sys.argv[1:2] == ["fetch"]:
+        fetch(fetch_parser.parse_args(sys.argv[2:]))
+        return
+
     # get parameters
-    num_reads, data, res = get_params()
+    data, res = get_params()
     
-    # create output queue and process pool
-    manager = mp.Manager()
-    output_queue = manager.Queue()
-    pool = mp.Pool(processes=PARAMS["processes"] + 1) # +1 for `fq_writer`
+    # plan batches: byte ranges snapped to record boundaries
+    batch_bytes = max(int(FastqIO.record_size(PARAMS["input_fq"]) * PARAMS["batch_size"]), 1)
+    if FastqIO.random_access(PARAMS["input_fq"]):
+        # workers seek to and decompress their own slices (BGZF inputs are
+        # indexed from the block headers; see `GzipIndexIO`)
+        chunk_size = max(
+            min(batch_bytes, FastqIO.size(PARAMS["input_fq"]) // PARAMS["processes"] + 1),
+            1
+        )
+        slices = (
+            (start, end, None) for start, end in
+            FastqIO.partition(PARAMS["input_fq"], chunk_size)
+        )
+    else:
+        # no random access (gzip other than BGZF): decompress once and hand
+        # slices of `--batch_size` reads to workers
+        logging.info("Input has no random access; decompressing in a single pass")
+        slices = FastqIO.stream_file(PARAMS["input_fq"], batch_bytes)
+
+    # create output queue (or part files directory) and process pool
+    if PARAMS["sharded_output"]:
+        output_queue = None
+        PARAMS["shard_dir"] = tempfile.mkdtemp(
+            prefix=".nanoprepro_parts_",
+            dir=PARAMS["tmp_dir"]
+        )
+    else:
+        manager = mp.Manager()
+        output_queue = manager.Queue()
+    # shared state of the reorder buffer of `fq_writer` (--ordered)
+    if PARAMS["ordered"] and not PARAMS["sharded_output"]:
+        reorder = (manager.Condition(), manager.Value("q", 0), manager.Value("q", 0))
+    else:
+        reorder = None
+    pool = mp.Pool(
+        processes=PARAMS["processes"] + (0 if PARAMS["sharded_output"] else 1)
+    ) # +1 for `fq_writer`
     
     # initiate `REPORT_DICT`
     REPORT_DICT = {}
@@ -47,58 +89,91 @@ def main():
     REPORT_DICT["truncated/filtered"] = 0
     REPORT_DICT["full-length/passed"] = 0
     REPORT_DICT["full-length/filtered"] = 0
+    REPORT_DICT["ends/aligned"] = 0
+    REPORT_DICT["ends/skipped"] = 0
+    REPORT_DICT["unchecked/full-length"] = 0
+    REPORT_DICT["unchecked/truncated"] = 0
     
     
     # put fq_writer/report_logger to work
-    watcher_out = pool.apply_async(fq_writer, (output_queue,))
+    if PARAMS["sharded_output"]:
+        shard_handles = open_outputs()
+    else:
+        watcher_out = pool.apply_async(fq_writer, (output_queue, reorder))
 
     # create batch tasks
-    tasks = []
-    batches = max(num_reads // PARAMS["batch_size"] + 1, PARAMS["processes"])
-    batch_size = num_reads // batches + 1
-    for batch_id in range(batches):
-        tasks.append((
-            PARAMS["input_fq"],
-            output_queue,
-            batch_id,
-            batch_size
-        ))
+    tasks = (
+        (PARAMS["input_fq"], output_queue, batch_id, start, end, chunk, reorder)
+        for batch_id, (start, end, chunk) in enumerate(slices)
+    )
 
     # collect results from the workers through the pool result queue
-    MEANQ_LIST = []
-    read_counts_meanq_list = pool.starmap_async(batch_worker, tasks)
-    for read_count, meanq_list in read_counts_meanq_list.get():
+    # (at most one task is queued ahead of the workers to bound memory)
+    STATS = report_stats()
+    for batch_id, (read_count, stats) in enumerate(imap_bounded(
+            pool, batch_worker, tasks, PARAMS["processes"] + 1)):
         for k, v in read_count.items():
             REPORT_DICT[k] += v
-        MEANQ_LIST += meanq_list
+        for k, v in stats.items():
+            STATS[k] += v
+        # results arrive in batch order: append the batch's part files
+        if PARAMS["sharded_output"]:
+            merge_shards(shard_handles, batch_id)
 
     # close the pool and wait for the workers to finish
-    output_queue.put('kill')
+    if PARAMS["sharded_output"]:
+        close_outputs(shard_handles)
+        os.rmdir(PARAMS["shard_dir"])
+    else:
+        output_queue.put('kill')
     pool.close()
     pool.join()
     
     # get stop time
     REPORT_DICT["stop time"] = datetime.now().strftime("%Y/%m/%d-%H:%M:%S")
+    if PARAMS["fusion_check"] == "lazy":
+        logging.info(
+            f"Reads not checked for fusion: "
+            f"{REPORT_DICT['unchecked/full-length']:,d} full-length, "
+            f"{REPORT_DICT['unchecked/truncated']:,d} truncated"
+        )
+    if PARAMS["seed_filter"]:
+        logging.info(
+            f"Seed filter skipped {REPORT_DICT['ends/skipped']:,d} of "
+            f"{REPORT_DICT['ends/aligned'] + REPORT_DICT['ends/skipped']:,d} "
+            f"5'/3' alignments"
+        )
 
     # write report.html
     if PARAMS["report"]:
         logging.info("Creating report HTML")
         report = HTML_report()
         report.update_command_line()
-        report.update_params(res)
+        report.update_params(res if res is not None else "Not optimized (--beta 0)")
         report.update_optimized_data(data, n_iqr=10)
-        report.update_stats(REPORT_DICT, MEANQ_LIST)
+        report.update_stats(REPORT_DICT, STATS)
         report.write(PARAMS["report"])            
     
     return
 
 
+# submit tasks to `pool` with at most `limit` tasks in flight
+def imap_bounded(pool, func, tasks, limit):
+    pending = deque()
+    for task in tasks:
+        if len(pending) >= limit:
+            yield pending.popleft().get()
+        pending.append(pool.apply_async(func, task))
+    while pending:
+        yield pending.popleft().get()
+
+
 # worker function
-def batch_worker(input_file, output_queue, batch_id, batch_size):
+def batch_worker(input_file, output_queue, batch_id, start, end, chunk=None, reorder=None):
     # logging
     logging.info("Start batch %d" % batch_id)
     
-    # initiate `read_counter` and `meanq_list`
+    # initiate `read_counter` and `stats`
     read_counter = {
         "total reads": 0,
         "skipped": 0,
@@ -107,9 +182,13 @@ def batch_worker(input_file, output_queue, batch_id, batch_size):
         "truncated/passed": 0,
         "truncated/filtered": 0,
         "full-length/passed": 0,
-        "full-length/filtered": 0
+        "full-length/filtered": 0,
+        "ends/aligned": 0,
+        "ends/skipped": 0,
+        "unchecked/full-length": 0,
+        "unchecked/truncated": 0
     }
-    meanq_list = []
+    stats = {}
     
     # initiate Annotator
     annotator = Annotator(
@@ -121,118 +200,286 @@ def batch_worker(input_file, output_queue, batch_id, batch_size):
         pid3=PARAMS["pid3"],
         pid_body=PARAMS["pid_body"],
         w=PARAMS["poly_w"],
-        k=PARAMS["poly_k"]
+        k=PARAMS["poly_k"],
+        seed_filter=PARAMS["seed_filter"]
     )
     
-    # get reads (stored in memory)
+    # get reads (stored in memory as columns)
     logging.info(f"Batch {batch_id}: Loading reads")
-    reads = FastqIO.batch_read(
-        input_file,
-        batch_id * batch_size,
-        batch_size
+    # (annotations in read names are only needed if not re-annotated)
+    batch = FastqIO.batch_read_columns(
+        input_file, start, end, chunk,
+        parse_annot=PARAMS["disable_annot"] or not PARAMS["skip_header_annot"]
     )
-    logging.info(f"Batch {batch_id}: Loaded {len(reads):,d} reads")
+    logging.info(f"Batch {batch_id}: Loaded {len(batch):,d} reads")
     
-    # iterate through reads
-    for read in reads:
-        # update read counter and mean Q list
-        read_counter["total reads"] += 1
+    # update read counter and statistics of input reads
+    read_counter["total reads"] += len(batch)
+    if PARAMS["report"]:
+        stats = report_stats()
+        stats["meanq"].add(batch.meanq())
+        stats["length"].add(batch.lengths())
+
+    # annotate reads (--fusion_check lazy: fusion does not change the outcome
+    # of reads that will be filtered, or of any read if fusion reads are not
+    # written, so only their ends are annotated)
+    unchecked = np.zeros(len(batch), dtype=bool)
+    if not PARAMS["disable_annot"]:
+        check = None
+        if PARAMS["fusion_check"] == "lazy":
+            check = PARAMS["filter_short"] <= batch.lengths()
+            if not PARAMS["trim_adapter"]:
+                check &= PARAMS["filter_lowq"] <= batch.meanq()
+            if not PARAMS["output_fusion"]:
+                check[:] = False
+            unchecked = ~check & (batch.lengths() > annotator.min_fusion_length())
+        annotator.annotate_batch(batch, check=check)
+        read_counter["ends/aligned"] += annotator.aligned
+        read_counter["ends/skipped"] += annotator.skipped
+        # adapter/primer locations (bp from read termini)
         if PARAMS["report"]:
-            mean_q = SeqFastq.meanq(read)
-            meanq_list.append(mean_q)
-        # if (PARAMS["skip_short"] > len(read)) or (PARAMS["skip_lowq"] > mean_q):
-        #     read_counter["skipped"] += 1
-        #     continue
-
-
-        PASS = "passed"
-        # annotate reads
-        if not PARAMS["disable_annot"]:
-            annotator.annotate(read)
-
-        # try trimming
-        if PARAMS["trim_poly"]:
-            Processor.trimmer(read, True, True)
-        elif PARAMS["trim_adapter"]:
-            Processor.trimmer(read, False, True)
-
-        # orient read
-        if PARAMS["orientation"] != 0:
-            Processor.orientor(read, to=PARAMS["orientation"])
-
-        # check length
-        if PARAMS["filter_short"] > len(read):
-            PASS = "filtered"
-
-        # check quality
-        if PARAMS["filter_lowq"] > SeqFastq.meanq(read):
-            PASS = "filtered"
-        
-        # classify reads into one of: fusion/full-length/truncated
-        CLASS = None
-        if read.annot.fusion:
-            CLASS = "fusion"
-        elif read.annot.full_length:
-            CLASS = "full-length"
-        else:
-            CLASS = "truncated"
-        
-        # put read into queue
-        output_queue.put([read, (CLASS, PASS)])
-        
-        # update read counter
-        read_counter[f"{CLASS}/{PASS}"] += 1
+            stats["loc5"].add(batch.ploc5[batch.ploc5 > 0])
+            stats["loc3"].add((batch.lengths() - batch.ploc3)[batch.ploc3 > 0])
+
+    # try trimming
+    if PARAMS["trim_poly"]:
+        Processor.trimmer_batch(batch, True, True)
+    elif PARAMS["trim_adapter"]:
+        Processor.trimmer_batch(batch, False, True)
+
+    # orient reads
+    if PARAMS["orientation"] != 0:
+        Processor.orientor_batch(batch, to=PARAMS["orientation"])
+
+    # check length and quality
+    PASS = (PARAMS["filter_short"] <= batch.lengths()) & \
+        (PARAMS["filter_lowq"] <= batch.meanq())
+
+    # classify reads into one of: fusion/full-length/truncated
+    CLASS = {
+        "fusion": batch.fusion != 0,
+        "full-length": (batch.fusion == 0) & (batch.full_length != 0),
+        "truncated": (batch.fusion == 0) & (batch.full_length == 0)
+    }
+
+    # put reads into queue or part files (one sub-batch per class)
+    paths = output_paths()
+    seq = 0
+    for cls, is_cls in CLASS.items():
+        for pass_, is_pass in [("passed", PASS), ("filtered", ~PASS)]:
+            idx = np.flatnonzero(is_cls & is_pass)
+            if len(idx) and paths[(cls, pass_)]:
+                if PARAMS["sharded_output"]:
+                    write_shard(batch, idx, batch_id, cls, pass_)
+                else:
+                    for data in serialize(batch, idx, paths[(cls, pass_)]):
+                        put_output(output_queue, [data, (cls, pass_)], reorder, batch_id, seq)
+                        seq += 1
+            
+            # update read counter
+            read_counter[f"{cls}/{pass_}"] += len(idx)
+        if cls != "fusion":
+            read_counter[f"unchecked/{cls}"] += int(np.count_nonzero(is_cls & unchecked))
+    
+    # mark the end of the batch (number of messages) for the reorder buffer
+    if reorder:
+        output_queue.put([None, None, (batch_id, seq)])
     
     logging.info(f"Finished batch {batch_id}")
-    return read_counter, meanq_list
+    return read_counter, stats
+
+
+# histograms of the report (merged across batches; see `Histogram`)
+def report_stats():
+    return {
+        "meanq": Histogram.linear(0, 60, 300),
+        "length": Histogram.log(1, 1e7, 50),
+        "loc5": Histogram.log(1, 1e7, 50),
+        "loc3": Histogram.log(1, 1e7, 50)
+    }
+
+
+# put `m` into `queue`; in --ordered mode, tag `m` with its position in the
+# output and wait while the reorder buffer of `fq_writer` is full (reads of
+# the batch being written are never held back, so the writer always proceeds)
+def put_output(queue, m, reorder, batch_id, seq):
+    if reorder is None:
+        queue.put(m)
+        return
+    cond, head, buffered = reorder
+    with cond:
+        cond.wait_for(lambda: batch_id <= head.value or \
+            buffered.value < PARAMS["reorder_buffer"] * 2 ** 20)
+    queue.put(m + [(batch_id, seq)])
+    return
 
 
 # listener function
-def fq_writer(queue):
-    # initiate handle_dict
-    handle_dict = {}
-    
+def fq_writer(queue, reorder=None):
     # create/open output files
-    for name in ["output_fusion", "output_truncated", "output_full_length"]:
-        cls = {
-            "output_fusion": "fusion",
-            "output_truncated": "truncated",
-            "output_full_length": "full-length"
-        }[name]
-        # output passed
-        if PARAMS[name] == "-":
-            handle_dict[(cls, "passed")] = sys.stdout
-        elif PARAMS[name]:
-            os.makedirs(Path(PARAMS[name]).parent, exist_ok=True)
-            handle_dict[(cls, "passed")] = openg(Path(PARAMS[name]), "w")
-        else:
-            handle_dict[(cls, "passed")] = None
+    handle_dict = open_outputs()
 
-        # output filtered
-        if PARAMS[name] and PARAMS["suffix_filtered"]:
-            # open new file (truncate if already exist)
-            fout = Path(PARAMS[name])
-            fout = fout.stem + "_" + PARAMS["suffix_filtered"] + fout.suffix
-            handle_dict[(cls, "filtered")] = openg(fout, "w")
-        else:
-            handle_dict[(cls, "filtered")] = None
+    # reorder buffer (--ordered): messages keyed by (batch id, sequence number),
+    # number of messages of finished batches, and the position being written
+    pending = {}
+    batch_ends = {}
+    head = seq = buffered = 0
     
-    # write reads to output files
+    # write pre-serialized reads (see `serialize`) to output files
     while True:
         m = queue.get()
         if m == "kill":
             break
-        read, (cls, pass_) = m
-        if handle_dict[(cls, pass_)]:
-            FastqIO.write(handle_dict[(cls, pass_)], read)
+        if reorder is None:
+            data, (cls, pass_) = m
+            handle_dict[(cls, pass_)].write(data)
+            continue
+
+        # buffer the message (or the end of a batch)
+        data, key, (batch_id, i) = m
+        if data is None:
+            batch_ends[batch_id] = i
+        else:
+            pending[(batch_id, i)] = (data, key)
+            buffered += len(data)
+
+        # write messages that are next in input order
+        while True:
+            if (head, seq) in pending:
+                data, key = pending.pop((head, seq))
+                buffered -= len(data)
+                handle_dict[key].write(data)
+                seq += 1
+            elif batch_ends.get(head) == seq:
+                del batch_ends[head]
+                head, seq = head + 1, 0
+            else:
+                break
+
+        # release workers waiting for buffer space
+        cond, shared_head, shared_buffered = reorder
+        with cond:
+            shared_head.value = head
+            shared_buffered.value = buffered
+            cond.notify_all()
             
     # close handles
-    for handle in handle_dict.values():
-        handle.close()
+    close_outputs(handle_dict)
         
     return
 
 
+# output file of each (class, pass) combination ("-": stdout, None: no output)
+def output_paths():
+    paths = {}
+    for name, cls in [
+        ("output_fusion", "fusion"),
+        ("output_truncated", "truncated"),
+        ("output_full_length", "full-length")
+    ]:
+        # output passed
+        paths[(cls, "passed")] = PARAMS[name] if PARAMS[name] else None
+
+        # output filtered (next to the passed reads)
+        if PARAMS[name] and PARAMS["suffix_filtered"]:
+            fout = Path(PARAMS[name])
+            paths[(cls, "filtered")] = str(fout.with_name(
+                fout.stem + "_" + PARAMS["suffix_filtered"] + fout.suffix
+            ))
+        else:
+            paths[(cls, "filtered")] = None
+    return paths
+
+
+# open output files (truncate if already exist) as raw binary files;
+# workers write already compressed data (see `serialize`)
+def open_outputs():
+    handle_dict = {}
+    for key, path in output_paths().items():
+        if path == "-":
+            handle_dict[key] = sys.stdout.buffer
+        elif path:
+            os.makedirs(Path(path).parent, exist_ok=True)
+            handle_dict[key] = open(path, "wb")
+        else:
+            handle_dict[key] = None
+    return handle_dict
+
+
+# (gzip outputs without reads get an empty gzip member)
+def close_outputs(handle_dict):
+    paths = output_paths()
+    for key, handle in handle_dict.items():
+        if handle is sys.stdout.buffer:
+            handle.flush()
+        elif handle:
+            if Path(paths[key]).suffix == ".gz" and handle.tell() == 0:
+                handle.write(gzip.compress(b""))
+            handle.close()
+    return
+
+
+# reads `idx` in FASTQ format, in buffers of about `WRITER_BUFFER_SIZE`
+# bytes (gzip members if `path` is compressed)
+def serialize(batch, idx, path):
+    for group in batch.split(idx, WRITER_BUFFER_SIZE):
+        data = batch.to_fastq(group)
+        yield gzip.compress(data) if Path(path).suffix == ".gz" else data
+
+
+# part file of a batch for a (class, pass) combination
+def shard_path(batch_id, cls, pass_):
+    suffix = ".gz" if Path(output_paths()[(cls, pass_)]).suffix == ".gz" else ""
+    return Path(PARAMS["shard_dir"], f"{batch_id:08d}.{cls}.{pass_}{suffix}")
+
+
+# write reads `idx` to a part file (gzip members if compressed)
+def write_shard(batch, idx, batch_id, cls, pass_):
+    path = shard_path(batch_id, cls, pass_)
+    with open(path, "wb") as handle:
+        for data in serialize(batch, idx, path):
+            handle.write(data)
+    return
+
+
+# append the part files of a batch to the output files (gzip members can
+# be concatenated as raw bytes) and remove them
+def merge_shards(handle_dict, batch_id):
+    for (cls, pass_), handle in handle_dict.items():
+        if not handle:
+            continue
+        path = shard_path(batch_id, cls, pass_)
+        if path.exists():
+            with open(path, "rb") as part:
+                shutil.copyfileobj(part, handle, 1 << 24)
+            path.unlink()
+    return
+
+
+# `nanoprepro fetch`: write the reads of the IDs in `args.ids` (in the
+# order of the IDs) to `args.output`
+def fetch(args):
+    with open(args.ids) as handle:
+        names = [line.split()[0] for line in handle if line.strip()]
+    logging.info(f"Fetching {len(names):,d} reads from {args.input_fq}")
+    records = FastqIndexIO(args.input_fq).records(names)
+    missing = sum(record is None for record in records)
+    data = b"".join(
+        record if record.endswith(b"\n") else record + b"\n"
+        for record in records if record is not None
+    )
+    if args.output == "-":
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+    else:
+        os.makedirs(Path(args.output).parent, exist_ok=True)
+        with (gzip.open if Path(args.output).suffix == ".gz" else open)(args.output, "wb") as handle:
+            handle.write(data)
+    if missing:
+        logging.warning(f"{missing:,d} of {len(names):,d} read IDs were not found")
+    return
+
+
 # get parameters from command line arguments
 def get_params():
     global PARAMS
@@ -254,24 +501,30 @@ def get_params():
             sys.exit(1)
 
     # optimize AP identification parameters if `--beta` is specified   
-    data = None
+    data = res = None
     if PARAMS["beta"]:
         # initialize optimizer
         optimizer = Optimizer(
             p5_sense=PARAMS["p5_sense"],
-            p3_sense=PARAMS["p3_sense"]
+            p3_sense=PARAMS["p3_sense"],
+            window=PARAMS["search_window"]
         )
         p5_len = len(PARAMS["p5_sense"])
         p3_len = len(PARAMS["p3_sense"])
         
         # sample `n` reads
-        logging.info("Counting records in FASTQ file")
+        logging.info("Sampling records from FASTQ file")
         sampled_fq, num_reads = FastqIO.sample(
             PARAMS["input_fq"],
             PARAMS["n"], 
-            PARAMS["seed"]
+            PARAMS["seed"],
+            PARAMS["sample_fraction"],
+            PARAMS["approx_sample"]
         )
-        logging.info(f"Found {num_reads:,d} records in FASTQ file")
+        if PARAMS["sample_fraction"] < 1 or PARAMS["approx_sample"]:
+            logging.info(f"Estimated {num_reads:,d} records in FASTQ file")
+        else:
+            logging.info(f"Found {num_reads:,d} records in FASTQ file")
         logging.info(f"Sampled {len(sampled_fq):,d} records for optimization")
     
         # optimize parameters            
@@ -281,7 +534,8 @@ def get_params():
             n_iqr=10,
             processes=PARAMS["processes"],
             target="fscore",
-            beta=PARAMS["beta"]
+            beta=PARAMS["beta"],
+            tmp_dir=PARAMS["tmp_dir"]
         )
         # update `PARAMS`
         PARAMS["p5_sense"] = out["left"]["seq"]
@@ -315,16 +569,9 @@ def get_params():
         )
         logging.info(res)
             
-    return num_reads, data, res
+    return data, res
 
 
-# extended open function
-def openg(p:Path, mode:str):
-    if p.suffix == ".gz":
-        return gzip.open(p, mode + "t")
-    else:
-        return open(p, mode)
-    
 if __name__ == "__main__":
    main()
    logging.info("Finished all analysis.")
\ No newline at end of file
@@ -1,7 +1,7 @@
 """Caller of edlib.align()"""
 from typing import Tuple, List
 import edlib
-import random
+import functools
 import math
 
 class edlibAligner:
@@ -11,10 +11,13 @@ class edlibAligner:
         mode: str,
         task: str,
         pid: float,
-        tie_breaking: str = "middle"
+        tie_breaking: str = "middle",
+        k: int = None
     ) -> dict:
-        # call edlib for the alignment
-        k = -1 if pid == -1 else math.ceil((1 - pid) * len(query))
+        # call edlib for the alignment (`k`: edit distance cutoff if tighter
+        # than the one of `pid`)
+        if k is None:
+            k = edlibAligner.maxDistance(len(query), pid)
         res = edlib.align(
             query,
             target,
@@ -54,30 +57,48 @@ class edlibAligner:
         tie_breaking: str = "middle"
     ) -> Tuple[str, dict]:
         res = name = None
-        # iterate over querys to find the best-aligned query
+        # iterate over querys to find the best-aligned query: a later query
+        # only wins with a higher pid, so its edit distance cutoff tightens
+        # as better alignments are found (and locations are only computed
+        # when a query aligns better than the previous ones)
         for qname, query in querys.items():
+            k = edlibAligner.maxDistance(len(query), pid, res["pid"] if res else -1)
+            if k is None:
+                continue
             new = edlibAligner.singleAlign(
                 query,
                 target,
                 mode,
                 task,
                 pid,
-                tie_breaking
+                tie_breaking,
+                k=k
             )
             
-            # the first alingment result
-            if not res:
+            # the new alignment result is better
+            if new["pid"] > (res["pid"] if res else -1):
                 res = new
                 name = qname
-                continue
 
-            # if the new alignment result is better
-            if new["pid"] > res["pid"]:
-                res = new
-                name = qname
+        # no alignment: the first query (with pid = -1)
+        if res is None:
+            name = next(iter(querys))
+            res = {"editDistance": -1, "cigar": None, "pid": -1, "location": (-1, -1)}
 
         return name, res
 
+    # largest edit distance of a query of length `m` with pid >= `pid` and
+    # pid > `better` (None: no such distance; -1: no limit)
+    @functools.lru_cache(maxsize=None)
+    def maxDistance(m: int, pid: float, better: float = None) -> int:
+        k = -1 if pid == -1 else math.ceil((1 - pid) * m)
+        if better is None:
+            return k
+        k = m if k == -1 else k
+        while k >= 0 and not (round(1 - k / m, 2) >= pid and round(1 - k / m, 2) > better):
+            k -= 1
+        return k if k >= 0 else None
+
 
     def ntopAligns(
             query: str,
@@ -88,25 +109,39 @@ class edlibAligner:
             n: int,
             tie_breaking: str = "middle"
         ) -> List[dict]:
+        # the next best alignment is the best one in the segments of the
+        # target left by the previous ones (`target[:start]` and
+        # `target[end:]` of an alignment at (start, end)); only the two new
+        # segments are aligned in each round, and ties go to the leftmost
         out = []
-        lastloc = None
+        segments = [(0, len(target), None)] if target else []
         for _ in range(n):
-            # replace the last alignment with random bases)
-            if lastloc:
-                target = target[:lastloc[0]] + \
-                    "".join(random.choice("ACGT") for _ in range(lastloc[1] - lastloc[0])) + \
-                    target[lastloc[1]:]
-            
-            # align
-            res =  edlibAligner.singleAlign(
-                    query,
-                    target,
-                    mode,
-                    task,
-                    pid,
-                    tie_breaking
-                )
-            lastloc = res["location"] if res["pid"] != -1 else None
-            out.append(res)            
-                
-        return out
\ No newline at end of file
+            for j, (start, end, res) in enumerate(segments):
+                if res is None:
+                    res = edlibAligner.singleAlign(
+                        query,
+                        target[start:end],
+                        mode,
+                        task,
+                        pid,
+                        tie_breaking
+                    )
+                    if res["pid"] != -1:
+                        res["location"] = (res["location"][0] + start, res["location"][1] + start)
+                    segments[j] = (start, end, res)
+
+            # no alignment left (pid = -1)
+            hits = [j for j, (_, _, res) in enumerate(segments) if res["pid"] != -1]
+            if not hits:
+                out.append({"editDistance": -1, "cigar": None, "pid": -1, "location": (-1, -1)})
+                continue
+
+            # split the segment of the best alignment
+            best = min(hits, key=lambda j: segments[j][2]["editDistance"])
+            start, end, res = segments[best]
+            out.append(res)
+            segments[best:best + 1] = [
+                (a, b, None) for a, b in ((start, res["location"][0]), (res["location"][1], end))
+                if b > a
+            ]
+        return out
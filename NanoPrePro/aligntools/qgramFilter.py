@@ -0,0 +1,77 @@
+"""q-gram filter to rule out edlib.align() hits"""
+import numpy as np
+import math
+
+# code of each byte in q-grams: ACGT -> 0-3, padding (0) -> 5, others -> 4
+# (merging other characters only adds hits, so the filter stays exact)
+ENCODE = np.full(256, 4, dtype=np.uint8)
+for _i, _b in enumerate(b"ACGT"):
+    ENCODE[_b] = _i
+ENCODE[0] = 5
+
+
+class qgramFilter:
+    """Exact filter of HW alignments with at most `k` edits (q-gram lemma)
+
+    `k` is the edit distance cutoff of `edlibAligner.singleAlign` at `pid`.
+    A substring of the target within `k` edits of the query is at most
+    `len(query) + k` long and shares at least `len(query) - q + 1 - k * q`
+    q-grams with the query, since every edit destroys at most `q` q-grams
+    of the query. Target windows of `len(query) + k` bases with fewer
+    q-grams of the query cannot hold a hit, so edlib can be skipped there.
+    """
+    def __init__(self, query: str, pid: float, width: int, max_q: int = 8) -> None:
+        self.query = query
+        self.k = -1 if pid == -1 else math.ceil((1 - pid) * len(query))
+        self.window = len(query) + self.k
+
+        # pick the q-gram length that best separates hits from random
+        # windows (expected number of shared q-grams in a random window);
+        # filters that would pass most random windows are not run at all
+        self.q, self.t = 0, 0
+        best = 0
+        for q in range(2, max_q + 1) if self.k >= 0 else []:
+            t = len(query) - q + 1 - self.k * q
+            expected = (min(self.window, width) - q + 1) * \
+                len(set(qgramFilter.encode(query, q).tolist())) / 4 ** q
+            if expected < t / 2 and t - expected > best:
+                self.q, self.t, best = q, t, t - expected
+
+        # q-grams of the query
+        if self.q:
+            self.lut = np.zeros(6 ** self.q, dtype=bool)
+            self.lut[qgramFilter.encode(query, self.q)] = True
+        return
+
+    # whether the filter can rule out any alignment
+    def active(self) -> bool:
+        return self.q > 0
+
+    # q-gram codes of `x` (str, or uint8 array of one target per row)
+    @staticmethod
+    def encode(x, q: int) -> np.ndarray:
+        single = isinstance(x, str)
+        if single:
+            x = np.frombuffer(x.encode(), dtype=np.uint8)[np.newaxis]
+        x = ENCODE[x]
+        n = max(x.shape[1] - q + 1, 0)
+        codes = x[:, :n].astype(np.uint16 if 6 ** q <= 1 << 16 else np.int32)
+        for j in range(1, q):
+            codes *= 6
+            codes += x[:, j:j + n]
+        return codes[0] if single else codes
+
+    # whether each target may hold a hit, given the q-gram codes of the
+    # targets (`qgramFilter.encode` of targets padded with 0, one per row)
+    def candidates(self, codes: np.ndarray) -> np.ndarray:
+        if not self.active() or codes.shape[1] == 0:
+            return np.ones(len(codes), dtype=bool)
+        # number of query q-grams in every window (upper bound of the
+        # number of q-grams shared with any substring of the window)
+        hits = self.lut[codes]
+        cum = np.zeros((len(codes), hits.shape[1] + 1), dtype=np.uint16)
+        np.cumsum(hits, axis=1, out=cum[:, 1:])
+        n = self.window - self.q + 1
+        if hits.shape[1] <= n:
+            return cum[:, -1] >= self.t
+        return (cum[:, n:] - cum[:, :-n] >= self.t).any(axis=1)
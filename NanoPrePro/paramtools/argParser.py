@@ -42,7 +42,7 @@ parser.add_argument(
 parser.add_argument(
     "--batch_size",
     type=int,
-    help="number of records in each batch (default: 1000000)",
+    help="approximate number of records in each batch (default: 1000000)",
     default=1000000
 )
 parser.add_argument(
@@ -61,6 +61,19 @@ parser.add_argument(
     help="max number of reads to sample during optimzation (default: 100000)",
     default=100000
 )
+parser.add_argument(
+    "--sample_fraction",
+    type=float,
+    help="fraction of the input file scanned to sample reads for optimization; "
+    "the number of reads is extrapolated if < 1 (default: 1)",
+    default=1
+)
+parser.add_argument(
+    "--approx_sample",
+    action="store_true",
+    help="use this flag to sample reads for optimization at random file offsets "
+    "without scanning the input (uncompressed or BGZF input only)"
+)
 parser.add_argument(
     "--beta",
     type=float,
@@ -73,6 +86,16 @@ parser.add_argument(
     help="the minimal primer length to test (default: .5)",
     default=.5
 )
+parser.add_argument(
+    "--search_window",
+    type=float,
+    help="number of bases at each read end searched for adapters/primers "
+    "during optimization; values below 1 are fractions of the read length "
+    "and 0 searches the whole read (default: 0). A window such as 5000 "
+    "speeds up optimization on long reads but may change the optimized "
+    "search locations (--isl5/--isl3)",
+    default=0
+)
 
 
 # annotaion options
@@ -81,6 +104,26 @@ parser.add_argument(
     action="store_true",
     help="use this flag to disable annotation"
 )
+parser.add_argument(
+    "--fusion_check",
+    type=str,
+    choices=["all", "lazy"],
+    default="all",
+    help="reads to check for fusion: all, or lazy to skip reads that will be filtered (or all reads without --output_fusion) (default: all)"
+)
+parser.add_argument(
+    "--seed_filter",
+    action="store_true",
+    help="use this flag to skip 5'/3' alignments that cannot reach --pid5/--pid3 (exact q-gram filter)"
+)
+parser.add_argument(
+    "--skip_header_annot",
+    action="store_true",
+    help="use this flag to skip parsing annotations in read names; annotations "
+    "of reads processed by NanoPreP before are then kept in the read names and "
+    "new ones are appended after them, e.g. strand=... twice (ignored with "
+    "--disable_annot)"
+)
 # parser.add_argument(
 #     "--skip_lowq",
 #     default=0,
@@ -195,3 +238,55 @@ parser.add_argument(
     type=str,
     help="output filtered reads with the suffix"
 )
+parser.add_argument(
+    "--ordered",
+    action="store_true",
+    help="use this flag to write reads in input order"
+)
+parser.add_argument(
+    "--reorder_buffer",
+    type=int,
+    help="max size (MB) of reads held back by --ordered (default: 1024)",
+    default=1024
+)
+parser.add_argument(
+    "--sharded_output",
+    action="store_true",
+    help="use this flag to let each process write its own part files, "
+    "which are concatenated in input order (implies --ordered)"
+)
+parser.add_argument(
+    "--tmp_dir",
+    type=str,
+    help="directory for temporary files, i.e. the part files of "
+    "--sharded_output and the read sample of --beta (default: the "
+    "system temporary directory)",
+    default=None
+)
+
+
+# `nanoprepro fetch`: extract reads by read ID
+fetch_parser = ArgumentParser(
+    prog="nanoprepro fetch",
+    description="extract reads from a FASTQ file by read ID (through the "
+    "index saved next to the input; see FastqIndex)",
+    formatter_class=MetavarTypeHelpFormatter
+)
+fetch_parser.add_argument(
+    "--input_fq",
+    required=True,
+    type=str,
+    help="input FASTQ"
+)
+fetch_parser.add_argument(
+    "--ids",
+    required=True,
+    type=str,
+    help="file of read IDs to extract (one per line)"
+)
+fetch_parser.add_argument(
+    "--output",
+    type=str,
+    help="output FASTQ (default: standard output)",
+    default="-"
+)
@@ -1,8 +1,12 @@
 from NanoPrePro.seqtools.SeqFastq import SeqFastq, SeqAnnot
+from NanoPrePro.seqtools.RecordBatch import RecordBatch
 from NanoPrePro.aligntools.edlibAligner import edlibAligner as aligner
+from NanoPrePro.aligntools.qgramFilter import qgramFilter
 from NanoPrePro.preptools.polyFinder import polyFinder
+from NanoPrePro.preptools.fusionFinder import fusionFinder
 from collections import namedtuple
 from typing import Tuple, Dict
+import numpy as np
 import re
 
 class Annotator(object):
@@ -16,7 +20,8 @@ class Annotator(object):
         pid3: float,
         pid_body: float,
         w: int,
-        k: int
+        k: int,
+        seed_filter: bool = False
     ) -> None:
         # parser of primer sequences
         prog5 = re.compile("(?P<p>[A-Z]+)((?P<n>[A-Z])\{(?P<max_n>[0-9]*)\})*")
@@ -60,57 +65,108 @@ class Annotator(object):
         self.w = w  # window size for polymer trimming
         self.k = k  # required number of polymers in the window
         self.poly = polymers
+
+        # internal adapters/primers (fusion) of reads in batches
+        self.fusion_finder = fusionFinder(
+            {
+                "p5_sense": p5_sense,
+                "p3_sense": p3_sense,
+                "p5_anti": p5_anti,
+                "p3_anti": p3_anti
+            },
+            pid_body
+        )
+
+        # q-gram filters of the alignments at read ends (see `annotate_batch`)
+        self.filters = {}
+        if seed_filter:
+            self.filters = {
+                (5, 1): qgramFilter(p5_sense, pid5, isl5[1] - isl5[0]),
+                (5, -1): qgramFilter(p5_anti, pid5, isl5[1] - isl5[0]),
+                (3, 1): qgramFilter(p3_sense, pid3, isl3[1] - isl3[0]),
+                (3, -1): qgramFilter(p3_anti, pid3, isl3[1] - isl3[0])
+            }
+        # number of alignments at read ends run/skipped
+        self.aligned = 0
+        self.skipped = 0
         return
 
-    # annotate features on SeqFastq
-    def annotate(self, read: SeqFastq, always: bool = False) -> None:
+    # annotate features on SeqFastq (alignments at read ends in `skip`, as
+    # (end, strand), are known to fail and are not run; `fusion`: result of
+    # the fusion detection if already known; homopolymers are left out if
+    # not `poly`)
+    def annotate(
+        self,
+        read: SeqFastq,
+        always: bool = False,
+        skip: set = (),
+        fusion: bool = None,
+        poly: bool = True
+    ) -> None:
         # reset annot
         read.annot = SeqAnnot()
 
         # detect fusion
-        if len(read) > \
-                (self.isl5[1] - self.isl5[0] + self.isl3[1] - self.isl3[0]):
-            name, res = aligner.bestAlign(
-                {
-                    "p5_sense": self.p5_sense,
-                    "p3_sense": self.p3_sense,
-                    "p5_anti": self.p5_anti,
-                    "p3_anti": self.p3_anti
-                },
-                read.seq[self.isl5[1]:self.isl3[0]],
-                mode="HW",
-                task="locations",
-                pid=self.pid_body
-            )
-            if res["pid"] > 0:
+        if len(read) > self.min_fusion_length():
+            if fusion is None:
+                name, res = aligner.bestAlign(
+                    {
+                        "p5_sense": self.p5_sense,
+                        "p3_sense": self.p3_sense,
+                        "p5_anti": self.p5_anti,
+                        "p3_anti": self.p3_anti
+                    },
+                    read.seq[self.isl5[1]:self.isl3[0]],
+                    mode="HW",
+                    task="locations",
+                    pid=self.pid_body
+                )
+                fusion = res["pid"] > 0
+            if fusion:
                 read.annot.fusion = 1
                 if not always:
                     return
 
         # align 5' primers to 5' isl
-        strand, res = aligner.bestAlign(
-            {1: self.p5_sense, -1: self.p5_anti},
-            read.seq[self.isl5[0]:self.isl5[1]],
-            mode="HW",
-            task="locations",
-            pid=self.pid5,
-            tie_breaking="right"
-        )
-        if res["pid"] > 0:
+        querys = {
+            strand: query for strand, query in
+            {1: self.p5_sense, -1: self.p5_anti}.items()
+            if (5, strand) not in skip
+        }
+        self.aligned += len(querys)
+        self.skipped += 2 - len(querys)
+        if querys:
+            strand, res = aligner.bestAlign(
+                querys,
+                read.seq[self.isl5[0]:self.isl5[1]],
+                mode="HW",
+                task="locations",
+                pid=self.pid5,
+                tie_breaking="right"
+            )
+        if querys and res["pid"] > 0:
             read.annot.ploc5 = res["location"][-1] + self.isl5[0]
             read.annot.strand += round(strand * res["pid"] * .5, 2)
             strand5 = strand
 
         # align 3' primers to 3' isl
-        strand, res = aligner.bestAlign(
-            {1: self.p3_sense, -1: self.p3_anti},
-            read.seq[self.isl3[0]:self.isl3[1]],
-            mode="HW",
-            task="locations",
-            pid=self.pid3,
-            tie_breaking="left"
-        )
-        if res["pid"] > 0:
+        querys = {
+            strand: query for strand, query in
+            {1: self.p3_sense, -1: self.p3_anti}.items()
+            if (3, strand) not in skip
+        }
+        self.aligned += len(querys)
+        self.skipped += 2 - len(querys)
+        if querys:
+            strand, res = aligner.bestAlign(
+                querys,
+                read.seq[self.isl3[0]:self.isl3[1]],
+                mode="HW",
+                task="locations",
+                pid=self.pid3,
+                tie_breaking="left"
+            )
+        if querys and res["pid"] > 0:
             read.annot.ploc3 = res["location"][0] + \
                 self.isl3[0] + len(read.seq)
             read.annot.strand += round(strand * res["pid"] * .5, 2)
@@ -125,7 +181,7 @@ class Annotator(object):
             read.annot.full_length = 1
 
         # identify homopolymers with `polyFinder`
-        if self.poly:
+        if poly:
             for (end, strand), (n, max_n) in self.poly.items():
                 # strand == read.annot.strand
                 if strand * read.annot.strand > 0:
@@ -136,3 +192,60 @@ class Annotator(object):
                     }[end]
                     finder(read, n, max_n, k=self.k, w=self.w)
         return
+
+    # reads longer than this are checked for fusion
+    def min_fusion_length(self) -> int:
+        return self.isl5[1] - self.isl5[0] + self.isl3[1] - self.isl3[0]
+
+    # annotate features on every read of a RecordBatch (reads not in `check`
+    # are not checked for fusion and only annotated at their ends)
+    def annotate_batch(
+        self,
+        batch: RecordBatch,
+        always: bool = False,
+        chunk_size: int = 4096,
+        check: np.ndarray = None,
+        chunk_bases: int = 1 << 22
+    ) -> None:
+        # fusion reads (seeds of all querys in one scan per chunk of about
+        # `chunk_bases` bases; see `fusionFinder`)
+        check = np.ones(len(batch), dtype=bool) if check is None else check
+        fusion = np.where(check, None, False)
+        total = np.cumsum(batch.lengths())
+        cuts = np.searchsorted(total, np.arange(chunk_bases, total[-1] if len(total) else 0, chunk_bases))
+        for idx in np.split(np.arange(len(batch)), np.unique(cuts)) if self.fusion_finder.active else []:
+            idx = idx[(batch.lengths()[idx] > self.min_fusion_length()) & check[idx]]
+            fusion[idx] = self.fusion_finder.find(batch, self.isl5[1], self.isl3[0], idx)
+
+        # alignments at read ends ruled out by the q-gram filters
+        skip = {}
+        for start in range(0, len(batch), chunk_size) if self.filters else []:
+            idx = np.arange(start, min(start + chunk_size, len(batch)))
+            targets = {
+                5: batch.slices(*self.isl5, idx),
+                3: batch.slices(*self.isl3, idx)
+            }
+            codes = {}
+            for (end, strand), qfilter in self.filters.items():
+                if not qfilter.active():
+                    continue
+                if (end, qfilter.q) not in codes:
+                    codes[(end, qfilter.q)] = qgramFilter.encode(targets[end], qfilter.q)
+                for i in idx[~qfilter.candidates(codes[(end, qfilter.q)])].tolist():
+                    skip.setdefault(i, set()).add((end, strand))
+
+        for i in range(len(batch)):
+            read = SeqFastq(seq=batch.sequence(i))
+            self.annotate(read, always, skip.get(i, ()), fusion[i], poly=False)
+            batch.set_annot(i, read.annot)
+
+        # identify homopolymers of `chunk_size` reads at once
+        for (end, strand), (n, max_n) in self.poly.items():
+            finder = {
+                5: polyFinder.lfind_batch,
+                3: polyFinder.rfind_batch
+            }[end]
+            idx = np.flatnonzero(strand * batch.strand > 0)
+            for start in range(0, len(idx), chunk_size):
+                finder(batch, idx[start:start + chunk_size], n, max_n, k=self.k, w=self.w)
+        return
@@ -1,10 +1,11 @@
 from NanoPrePro.seqtools.SeqFastq import SeqFastq
+from NanoPrePro.seqtools.FastqIO import FastqIO
 from NanoPrePro.aligntools.edlibAligner import edlibAligner as aligner
 from typing import Tuple, Dict, List
 from multiprocessing import Pool
 import numpy as np
 import pandas as pd
-import re
+import re, tempfile
 
 class Optimizer:
     def __init__(
@@ -12,7 +13,8 @@ class Optimizer:
             p5_sense: str,
             p3_sense: str,
             p5_anti: str = None,
-            p3_anti: str = None
+            p3_anti: str = None,
+            window: float = 0
         ) -> None:
         # parser of primer sequences
         prog5 = re.compile("(?P<p>[A-Z]+)((?P<n>[A-Z])\{(?P<max_n>[0-9]*)\})*")
@@ -34,6 +36,8 @@ class Optimizer:
         self.poly_n3 = poly_n3
         self.max_n5 = max_n5 if max_n5 else 0
         self.max_n3 = max_n3 if max_n3 else 0
+        # bases searched from each end of a read (see `Optimizer.search`)
+        self.window = window
         return
     
     def optimize(
@@ -43,8 +47,20 @@ class Optimizer:
             n_iqr:List[int],
             processes: int,
             target: str,
-            beta: float
+            beta: float,
+            tmp_dir: str = None
         ) -> Dict[str, object]:
+        # write the sample once to a temporary FASTQ file, which workers
+        # memory-map (pages are shared) instead of receiving a pickled
+        # copy of the sample with every task
+        if not isinstance(fq_iter, str):
+            with tempfile.NamedTemporaryFile(
+                "w", prefix=".nanoprepro_sample_", suffix=".fastq", dir=tmp_dir
+            ) as handle:
+                for read in fq_iter:
+                    FastqIO.write(handle, read)
+                handle.flush()
+                return self.optimize(handle.name, plens, n_iqr, processes, target, beta)
         res_l, data_l = self.optimizeLIP(fq_iter, plens, "left", n_iqr, processes, target, beta)
         res_r, data_r = self.optimizeLIP(fq_iter, plens, "right", n_iqr, processes, target, beta)
         out = {
@@ -87,7 +103,8 @@ class Optimizer:
         """Find the optimal primer length (int), pid cutoff (float), and ideal searching location Tuple[int, int]
 
         Args:
-            fq_iter (iter): an iterator to fastq file
+            fq_iter (iter): an iterator to fastq file (or the path to an
+                uncompressed fastq file, memory-mapped by the workers)
 
         Returns:
             Dict[str, object]:  optimzed parameters
@@ -124,7 +141,8 @@ class Optimizer:
         """Find the optimal pid cutoff (float) and ideal searching location (int) at certain primer length
 
         Args:
-            fq_iter (iter): an iterator to fastq file
+            fq_iter (iter): an iterator to fastq file (or the path to an
+                uncompressed fastq file)
             plen (float): length of the primer to use
             site (str): "left" or "right"
             
@@ -144,12 +162,17 @@ class Optimizer:
         tmp_loc = data[data["cls"] == "positive"]["loc"]
         isls = np.linspace(tmp_loc.median(), tmp_loc.quantile(.90) + 50, n_iqr).flatten()
         
-        # iter over pid and loc targets
-        for pid in pids:
-            for location in isls:
-                res = self.calculateAP(data, pid, location, beta)
-                if res[target] > out[target]:
-                    out = res
+        # evaluate every (pid, loc) target at once; the first best one in
+        # the order of iteration (pid descending, then loc) is kept
+        grid = self.calculateAPs(data, pids, isls, beta)
+        best = np.argmax(grid[target])
+        i, j = np.unravel_index(best, grid[target].shape)
+        if grid[target].size and grid[target][i, j] > out[target]:
+            out = {
+                "pid": pids[i],
+                "loc": isls[j],
+                **{metric: float(grid[metric][i, j]) for metric in ("accr", "prec", "recall", "fscore")}
+            }
         out["plen"] = plen
         return out, data
     
@@ -178,6 +201,51 @@ class Optimizer:
             "fscore": fscore
         }
     
+    # `calculateAP` for every pid cutoff (rows) and isl cutoff (columns)
+    @staticmethod
+    def calculateAPs(
+            data: pd.DataFrame,
+            pid_cutoffs: np.ndarray,
+            isl_cutoffs: np.ndarray,
+            beta: float
+        ) -> Dict[str, np.ndarray]:
+        pid = data["pid"].to_numpy()
+        loc = data["loc"].to_numpy()
+        positive = (data["cls"] == "positive").to_numpy()
+        negative = (data["cls"] == "negative").to_numpy()
+
+        # rows passing each pid cutoff: pid >= pid_cutoffs[i] for i >= rank
+        order = np.argsort(pid_cutoffs)[::-1]
+        rank = np.searchsorted(-pid_cutoffs[order], -pid, side="left")
+        # rows passing each isl cutoff
+        accepted = loc[:, np.newaxis] <= isl_cutoffs[np.newaxis, :]
+
+        # counts of rows passing both cutoffs (cumulative over pid cutoffs)
+        def count(rows):
+            m = len(isl_cutoffs)
+            cells = rank[rows][:, np.newaxis] * m + np.arange(m)
+            counts = np.bincount(cells[accepted[rows]], minlength=(len(pid_cutoffs) + 1) * m)
+            counts = np.cumsum(counts.reshape(-1, m), axis=0)[:-1]
+            out = np.empty_like(counts)
+            out[order] = counts
+            return out
+        tp = count(positive)
+        fp = count(negative)
+        tn = np.count_nonzero(negative) - fp
+        fn = np.count_nonzero(positive) - tp
+
+        # metrics (same expressions as `calculateAP`)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            accr = (tp + tn) / (tp + tn + fp + fn)
+            prec = np.where(tp + fp > 0, tp / (tp + fp), -1)
+            recall = np.where(tp + fn > 0, tp / (tp + fn), -1)
+            fscore = np.where(
+                (prec > 0) & (recall > 0),
+                (1 + beta ** 2) * prec * recall / (((beta ** 2) * prec) + recall),
+                -1
+            )
+        return {"accr": accr, "prec": prec, "recall": recall, "fscore": fscore}
+
     # get PID, Location, and Class dataframe of 5'/3' primers
     def getPLC(
             self,
@@ -198,6 +266,10 @@ class Optimizer:
             "cls": []
         }
         
+        # reads of an uncompressed FASTQ file (lazy views of a memory map)
+        if isinstance(fq_iter, str):
+            fq_iter = FastqIO.mmap_read(fq_iter)
+
         # iter over reads in fq_iter
         for read in fq_iter:
             # get [pid, location, class] of top 2 best aligned primers
@@ -228,12 +300,13 @@ class Optimizer:
             List[Tuple[int, int]]
         """
 
+        seq = self.search(read.seq, "left")
         l = int(round(len(self.p5_sense) * plen))
         sense = \
             [(i["pid"], i["location"][1]) for i in 
             aligner.ntopAligns(
                 self.p5_sense[-l:],
-                read.seq,
+                seq,
                 "HW",
                 "locations",
                 -1,
@@ -245,7 +318,7 @@ class Optimizer:
             [(i["pid"], i["location"][1]) for i in 
             aligner.ntopAligns(
                 self.p5_anti[-l:],
-                read.seq,
+                seq,
                 "HW",
                 "locations",
                 -1,
@@ -275,12 +348,13 @@ class Optimizer:
         Returns:
             List[SimpleResult(pid, location)]
         """
+        seq = self.search(read.seq, "right")
         l = int(round(len(self.p3_sense) * plen))
         sense =  \
-            [(i["pid"], len(read.seq) - i["location"][0]) for i in 
+            [(i["pid"], len(seq) - i["location"][0]) for i in 
             aligner.ntopAligns(
                 self.p3_sense[:l],
-                read.seq,
+                seq,
                 "HW",
                 "locations",
                 -1,
@@ -288,10 +362,10 @@ class Optimizer:
             )
         ]
         anti = \
-            [(i["pid"], len(read.seq) - i["location"][0]) for i in 
+            [(i["pid"], len(seq) - i["location"][0]) for i in 
             aligner.ntopAligns(
                 self.p3_anti[:l],
-                read.seq,
+                seq,
                 "HW",
                 "locations",
                 -1,
@@ -302,4 +376,15 @@ class Optimizer:
             return sense
         else:
             return anti
-    
\ No newline at end of file
+    
+
+    # the part of `seq` searched for 5' ("left") or 3' ("right") primers:
+    # the first/last `window` bases (a fraction of the read length if
+    # `window` < 1; the whole read if `window` is 0)
+    def search(self, seq: str, site: str) -> str:
+        if not self.window:
+            return seq
+        n = int(self.window) if self.window >= 1 else int(round(len(seq) * self.window))
+        if n >= len(seq):
+            return seq
+        return seq[:n] if site == "left" else seq[len(seq) - n:]
@@ -1,4 +1,6 @@
 from NanoPrePro.seqtools.SeqFastq import SeqFastq
+from NanoPrePro.seqtools.RecordBatch import RecordBatch
+import numpy as np
 
 class Processor:
     def trimmer(
@@ -46,3 +48,44 @@ class Processor:
             read.reverse_complement()
 
         return
+
+    # `trimmer` on every read of a RecordBatch
+    def trimmer_batch(
+        batch: RecordBatch,
+        trim_poly: bool,
+        trim_adapt: bool
+    ) -> None:
+        n = batch.lengths()
+
+        # get 5' cutpoints
+        poly5 = (batch.poly5 > 0) & trim_poly
+        adapt5 = ~poly5 & (batch.ploc5 > 0) & trim_adapt
+        a = np.zeros(len(batch), dtype=np.int64)
+        a[poly5] = batch.ploc5[poly5] + batch.poly5[poly5]
+        a[adapt5] = batch.ploc5[adapt5]
+        batch.ploc5[poly5 | adapt5] = 0  # 0: trimmed
+        batch.poly5[poly5] *= -1  # int < 0: trimmed
+
+        # get 3' cutpoints
+        poly3 = (batch.poly3 > 0) & trim_poly
+        adapt3 = ~poly3 & (batch.ploc3 > 0) & trim_adapt
+        b = n.copy()
+        b[poly3] = batch.ploc3[poly3] - batch.poly3[poly3]
+        b[adapt3] = batch.ploc3[adapt3]
+        batch.ploc3[poly3 | adapt3] = 0  # 0: trimmed
+        batch.poly3[poly3] *= -1  # int < 0: trimmed
+
+        # trim reads (same bounds as `read.seq[a:b]`)
+        a = np.clip(np.where(a < 0, a + n, a), 0, n)
+        b = np.clip(np.where(b < 0, b + n, b), 0, n)
+        batch.trim(a, np.maximum(a, b))
+
+        return
+
+    # `orientor` on every read of a RecordBatch
+    def orientor_batch(batch: RecordBatch, to: int) -> None:
+        # re-orient reads with known strand
+        batch.reverse_complement(np.flatnonzero(
+            (batch.strand != 0) & (batch.strand * batch.orientation * to < 0)
+        ))
+        return
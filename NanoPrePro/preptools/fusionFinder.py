@@ -0,0 +1,108 @@
+from NanoPrePro.seqtools.RecordBatch import RecordBatch
+from NanoPrePro.aligntools.edlibAligner import edlibAligner as aligner
+from NanoPrePro.aligntools.qgramFilter import qgramFilter
+import numpy as np
+import math
+
+class fusionFinder:
+    """Find internal adapters/primers of reads with seeds and verification
+
+    A hit of a query within `k` edits (the cutoff of
+    `edlibAligner.singleAlign` at `pid`) holds at least one of `k + 1`
+    disjoint pieces of the query without edits (pigeonhole principle).
+    The read bodies of a batch are scanned once for the seeds (the first
+    `seed` bases of each piece) of all querys, and only the text around
+    seed hits is aligned with edlib, which finds the same best hit as
+    aligning the whole body.
+    """
+    def __init__(self, querys: dict, pid: float, max_seed: int = 8) -> None:
+        self.querys = querys
+        self.pid = pid
+        self.k = [
+            -1 if pid == -1 else math.ceil((1 - pid) * len(query))
+            for query in querys.values()
+        ]
+        self.size = [
+            len(query) // (k + 1) if k >= 0 else 0
+            for query, k in zip(querys.values(), self.k)
+        ]
+
+        # seed length (at most the shortest piece)
+        self.seed = min(self.size + [max_seed])
+        self.active = self.seed > 0 and len(querys) <= 8
+        if not self.active:
+            return
+
+        # seeds of each query (bit `i` of `lut[code]`: seed of query `i`)
+        self.lut = np.zeros(6 ** self.seed, dtype=np.uint8)
+        for i, (query, k, size) in enumerate(zip(querys.values(), self.k, self.size)):
+            for start in range(0, (k + 1) * size, size):
+                code = qgramFilter.encode(query[start:start + self.seed], self.seed)
+                self.lut[code] |= 1 << i
+
+        # seeding only pays off if seed hits leave most of the body out
+        # (expected length of random text aligned per base)
+        coverage = sum(
+            np.count_nonzero(self.lut & 1 << i) / 4 ** self.seed *
+            (2 * len(query) - self.seed + 2 * k)
+            for i, (query, k) in enumerate(zip(querys.values(), self.k))
+        )
+        self.active = coverage < .5
+        return
+
+    # whether the body seq[a:b] (as in `read.seq[a:b]`) of reads `idx` holds
+    # any query with pid >= `pid` (as `edlibAligner.bestAlign` would find)
+    def find(self, batch: RecordBatch, a: int, b: int, idx: np.ndarray) -> np.ndarray:
+        found = np.zeros(len(idx), dtype=bool)
+        if len(idx) == 0:
+            return found
+
+        # bodies (bounds in `batch.seq`)
+        n = batch.lengths()[idx]
+        starts = batch.starts[idx] + np.clip(np.where(a < 0, a + n, a), 0, n)
+        ends = batch.starts[idx] + np.clip(np.where(b < 0, b + n, b), 0, n)
+        ends = np.maximum(starts, ends)
+
+        # seed hits in `batch.seq` (scanned once for all querys)
+        lo, hi = starts.min(), ends.max()
+        bits = self.lut[qgramFilter.encode(batch.seq[np.newaxis, lo:hi], self.seed)[0]]
+        pos = np.flatnonzero(bits) + lo
+
+        # seed hits within the bodies, grouped by read
+        order = np.argsort(starts, kind="stable")
+        row = order[np.maximum(np.searchsorted(starts[order], pos, side="right") - 1, 0)]
+        keep = (pos >= starts[row]) & (pos + self.seed <= ends[row])
+        pos, row = pos[keep], row[keep]
+        bits = bits[pos - lo]
+        group = np.argsort(row, kind="stable")
+        rows, counts = np.unique(row[group], return_counts=True)
+
+        # align querys around seed hits (overlapping windows are merged)
+        querys = list(self.querys.values())
+        for r, hits in zip(rows.tolist(), np.split(group, np.cumsum(counts)[:-1])):
+            body = batch.seq[starts[r]:ends[r]].tobytes().decode()
+            for i, (query, k) in enumerate(zip(querys, self.k)):
+                p = pos[hits[(bits[hits] & 1 << i) != 0]] - starts[r]
+                lefts = np.maximum(p - (len(query) - self.seed) - k, 0)
+                rights = np.minimum(p + len(query) + k, len(body))
+                if any(
+                    aligner.singleAlign(
+                        query, body[left:right], mode="HW",
+                        task="locations", pid=self.pid
+                    )["pid"] > 0
+                    for left, right in fusionFinder.merge(lefts, rights)
+                ):
+                    found[r] = True
+                    break
+        return found
+
+    # union of the intervals [lefts[i], rights[i]) (sorted by `lefts`)
+    @staticmethod
+    def merge(lefts: np.ndarray, rights: np.ndarray) -> list:
+        out = []
+        for left, right in zip(lefts.tolist(), rights.tolist()):
+            if out and left <= out[-1][1]:
+                out[-1][1] = max(out[-1][1], right)
+            else:
+                out.append([left, right])
+        return out
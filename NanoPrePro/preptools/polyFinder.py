@@ -1,6 +1,10 @@
 from NanoPrePro.seqtools.SeqFastq import SeqFastq
+from NanoPrePro.seqtools.RecordBatch import RecordBatch
+import numpy as np
 
 class polyFinder:
+    """Find homopolymers next to adapters/primers with a sliding window
+    (`*_batch`: prefix sums of `seq == n` over many reads at once)"""
     # find the length of homopolymers `n` next to ploc5
     def lfind(
         read: SeqFastq,
@@ -52,3 +56,131 @@ class polyFinder:
         # report poly
         read.annot.poly3 = read.annot.ploc3 - i + w - 1
         return
+
+    # `lfind` on reads `idx` of a RecordBatch
+    def lfind_batch(
+        batch: RecordBatch,
+        idx: np.ndarray,
+        n: str,
+        max_n: int,
+        k: int,
+        w: int
+    ) -> None:
+        idx = idx[batch.ploc5[idx] != -1]
+        batch.poly5[idx] = polyFinder.find(
+            batch.seq, batch.starts[idx], batch.lengths()[idx],
+            batch.ploc5[idx], n, max_n, k, w, end=5
+        )
+        return
+
+    # `rfind` on reads `idx` of a RecordBatch
+    def rfind_batch(
+        batch: RecordBatch,
+        idx: np.ndarray,
+        n: str,
+        max_n: int,
+        k: int,
+        w: int
+    ) -> None:
+        idx = idx[batch.ploc3[idx] != -1]
+        batch.poly3[idx] = polyFinder.find(
+            batch.seq, batch.starts[idx], batch.lengths()[idx],
+            batch.ploc3[idx], n, max_n, k, w, end=3
+        )
+        return
+
+    # homopolymer lengths next to `locs` of the reads seq[starts:starts+lengths]
+    # (`end` 5: windows seq[i:i+w] for i = loc, loc + 1, ...; `end` 3:
+    # windows seq[i-w:i] for i = loc, loc - 1, ...)
+    @staticmethod
+    def find(
+        seq: np.ndarray,
+        starts: np.ndarray,
+        lengths: np.ndarray,
+        locs: np.ndarray,
+        n: str,
+        max_n: int,
+        k: int,
+        w: int,
+        end: int
+    ) -> np.ndarray:
+        # window positions tried before `max_n` is exceeded
+        m = max(max_n - w + 1, 0)
+        stop = np.zeros(len(locs), dtype=np.int64)
+        if len(locs) == 0 or m == 0:
+            return stop + w - 1
+
+        # windows that start within the read are only cut at the read end
+        near = (locs >= (0 if end == 5 else max_n)) & (w > 0)
+        for rows, counts in (
+            (near, polyFinder.near_counts),
+            (~near, polyFinder.window_counts)
+        ):
+            if not rows.any():
+                continue
+            # the window stops at the first position with less than `k` bases `n`
+            passed = counts(seq, starts[rows], lengths[rows], locs[rows], n, m, w, end) >= k
+            stop[rows] = np.where(passed.all(axis=1), m, passed.argmin(axis=1))
+        return stop + w - 1
+
+    # number of `n` in the `m` windows of each read, counted on the `m + w - 1`
+    # bases next to the primer (`w` > 0; every window starts within the read)
+    @staticmethod
+    def near_counts(
+        seq: np.ndarray,
+        starts: np.ndarray,
+        lengths: np.ndarray,
+        locs: np.ndarray,
+        n: str,
+        m: int,
+        w: int,
+        end: int
+    ) -> np.ndarray:
+        width = m + w - 1
+        first = locs if end == 5 else locs - width
+        # bases past the read end count as other bases (windows are cut there)
+        pos = np.minimum(first, lengths)[:, np.newaxis] + np.arange(width)
+        inside = pos < lengths[:, np.newaxis]
+        hits = np.zeros(pos.shape, dtype=bool)
+        hits[inside] = seq[(starts[:, np.newaxis] + pos)[inside]] == ord(n)
+        if end == 3:
+            hits = hits[:, ::-1]
+        cum = np.zeros((len(locs), width + 1), dtype=np.int32)
+        np.cumsum(hits, axis=1, out=cum[:, 1:])
+        return cum[:, w:] - cum[:, :m]
+
+    # number of `n` in the `m` windows of each read (any `w` and `locs`)
+    @staticmethod
+    def window_counts(
+        seq: np.ndarray,
+        starts: np.ndarray,
+        lengths: np.ndarray,
+        locs: np.ndarray,
+        n: str,
+        m: int,
+        w: int,
+        end: int
+    ) -> np.ndarray:
+        step = np.arange(m)
+        if end == 5:
+            a = locs[:, np.newaxis] + step
+            b = a + w
+        else:
+            b = locs[:, np.newaxis] - step
+            a = b - w
+
+        # window bounds within each read (as `read.seq[a:b]`)
+        size = lengths[:, np.newaxis]
+        a = np.clip(np.where(a < 0, a + size, a), 0, size)
+        b = np.clip(np.where(b < 0, b + size, b), 0, size)
+        b = np.maximum(a, b)
+
+        # prefix sums of `seq == n` over the bases covered by the windows
+        lo, hi = a.min(axis=1), b.max(axis=1)
+        offsets = np.zeros(len(locs) + 1, dtype=np.int64)
+        np.cumsum(hi - lo, out=offsets[1:])
+        pos = np.repeat(starts + lo - offsets[:-1], hi - lo) + np.arange(offsets[-1])
+        cum = np.zeros(offsets[-1] + 1, dtype=np.int64)
+        np.cumsum(seq[pos] == ord(n), out=cum[1:])
+        base = (offsets[:-1] - lo)[:, np.newaxis]
+        return cum[base + b] - cum[base + a]
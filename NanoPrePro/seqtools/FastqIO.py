@@ -1,35 +1,158 @@
-from NanoPrePro.seqtools.SeqFastq import SeqFastq
+from NanoPrePro.seqtools.SeqFastq import SeqFastq, SeqFastqView
+from NanoPrePro.seqtools.GzipIndexIO import GzipIndexIO
+from NanoPrePro.seqtools.FastqIndex import FastqIndex
+from NanoPrePro.seqtools.RecordBatch import RecordBatch
 from io import TextIOWrapper
 from pathlib import Path
 from datetime import datetime
-from typing import List
-import gzip, random, sys
+from typing import BinaryIO, Iterator, List, Tuple
+import numpy as np
+import gzip, mmap, os, sys
 
 
 class FastqIO:
-    # Batch read FASTQ records
-    def batch_read(file: str, from_nth: int, batch_size: int) -> List[SeqFastq]:
-        with FastqIO.openg(file, "r") as handle:
-            line_generator = (i for i in handle)
-            line_counter = -1
-            res = []
-            while True:
-                new_line = next(line_generator, None)
-                if new_line is None:
+    # Batch read FASTQ records within the byte range [start, end) into columns
+    # (or from `data`, the bytes of that range, if provided)
+    def batch_read_columns(file: str, start: int, end: int, data: bytes = None, parse_annot: bool = True) -> RecordBatch:
+        return RecordBatch.from_buffer(*FastqIO.batch_buffer(file, start, end, data), parse_annot)
+
+    # buffer holding the byte range [start, end) -> (buffer, start, end)
+    def batch_buffer(file: str, start: int, end: int, data: bytes = None) -> tuple:
+        if data is not None:
+            return data, 0, len(data)
+        if Path(file).suffix == ".gz":
+            with FastqIO.openb(file) as handle:
+                handle.seek(start)
+                data = handle.read(end - start)
+            return data, 0, len(data)
+        return FastqIO.mmap(file), start, end
+
+    # FASTQ generator (lazy views) over a memory-mapped uncompressed file
+    def mmap_read(file: str, start: int = 0, end: int = None) -> Iterator[SeqFastqView]:
+        yield from FastqIO.scan(FastqIO.mmap(file), start, end)
+
+    # read-only memory map of an uncompressed file
+    def mmap(file: str):
+        with open(file, "rb") as handle:
+            if os.fstat(handle.fileno()).st_size == 0:
+                return b""
+            # the mapping stays valid after the handle is closed
+            return mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+    # FASTQ generator (lazy views) over buf[start:end] (bytes or mmap)
+    def scan(buf, start: int = 0, end: int = None) -> Iterator[SeqFastqView]:
+        end = len(buf) if end is None else min(end, len(buf))
+        find = buf.find
+        pos = start
+        while pos < end:
+            # (start, end) of the 4 lines without line breaks
+            offsets = []
+            for _ in range(4):
+                nl = find(b"\n", pos, end)
+                nl = end if nl < 0 else nl
+                offsets.append(pos)
+                offsets.append(nl - 1 if nl > pos and buf[nl - 1] == 13 else nl)
+                pos = nl + 1
+            # skip "@" and "+"
+            offsets[0] += 1
+            offsets[4] += 1
+            yield SeqFastqView(buf, tuple(offsets))
+        return
+
+    # split FASTQ file into byte ranges snapped to record boundaries
+    def partition(file: str, chunk_size: int) -> List[Tuple[int, int]]:
+        # record offsets of the index (if up to date)
+        index = FastqIndex.cached(file)
+        if index is not None:
+            size = index.size()
+            offsets = index.offsets[np.searchsorted(
+                index.offsets, np.arange(chunk_size, size, chunk_size, dtype=np.uint64)
+            )]
+            bounds = [0] + np.unique(offsets[(offsets > 0) & (offsets < size)]).tolist() + [size]
+            return list(zip(bounds[:-1], bounds[1:]))
+        size = FastqIO.size(file)
+        bounds = [0]
+        with FastqIO.openb(file) as handle:
+            for offset in range(chunk_size, size, chunk_size):
+                start = FastqIO.resync(handle, offset)
+                if bounds[-1] < start < size:
+                    bounds.append(start)
+        bounds.append(size)
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    # find the first record boundary at or after `offset`
+    def resync(handle: BinaryIO, offset: int) -> int:
+        if offset <= 0:
+            return 0
+        # skip the (partial) line `offset` falls in
+        handle.seek(offset - 1)
+        pos = offset - 1 + len(handle.readline())
+        # a record starts with "@" and has a "+" line two lines below;
+        # a quality line starting with "@" is never followed by such a
+        # pattern, so this is enough to tell headers from qualities
+        lines = [handle.readline() for _ in range(4)]
+        while lines[0]:
+            if lines[0][:1] == b"@" and lines[2][:1] == b"+" and \
+                    len(lines[1].rstrip()) == len(lines[3].rstrip()):
+                return pos
+            pos += len(lines.pop(0))
+            lines.append(handle.readline())
+        return pos
+
+    # average size (bytes) of the first `n` FASTQ records
+    def record_size(file: str, n: int = 1000) -> float:
+        nbytes = nrecords = 0
+        with FastqIO.openb(file) if FastqIO.random_access(file) else gzip.open(file, "rb") as handle:
+            while nrecords < n:
+                record = b"".join(handle.readline() for _ in range(4))
+                if not record:
                     break
-                line_counter += 1
-                if line_counter // 4 >= from_nth:
-                    res.append(SeqFastq.parse(
-                        new_line,
-                        next(line_generator),
-                        next(line_generator),
-                        next(line_generator)
-                    ))
-                    line_counter += 3
-                    if len(res) >= batch_size:
-                        break
-        return res
-    
+                nbytes += len(record)
+                nrecords += 1
+        return nbytes / nrecords if nrecords else 0
+
+    # size (bytes) of the (decompressed) FASTQ file (other gzip files than
+    # BGZF are decompressed once to index them; see `GzipIndexIO`)
+    def size(file: str) -> int:
+        if Path(file).suffix != ".gz":
+            return os.path.getsize(file)
+        with GzipIndexIO(file) as handle:
+            return handle.size()
+
+    # split a binary FASTQ stream into record-aligned chunks
+    def stream(handle: BinaryIO, chunk_size: int) -> Iterator[Tuple[int, int, bytes]]:
+        start = 0
+        carry = b""
+        while True:
+            new = handle.read(chunk_size)
+            data = carry + new
+            if not new:
+                if data:
+                    yield start, start + len(data), data
+                break
+            # cut after the last complete record (4 lines)
+            cut = len(data)
+            for _ in range(data.count(b"\n") % 4 + 1):
+                cut = data.rfind(b"\n", 0, cut)
+                if cut < 0:
+                    break
+            cut += 1
+            if cut == 0:
+                carry = data
+                continue
+            yield start, start + cut, data[:cut]
+            start += cut
+            carry = data[cut:]
+        return
+
+    # record-aligned chunks of a FASTQ file in a single sequential pass
+    # (gzip files are decompressed as a stream, without an index)
+    def stream_file(file: str, chunk_size: int = 1 << 24) -> Iterator[Tuple[int, int, bytes]]:
+        with open(file, "rb") as raw:
+            handle = gzip.GzipFile(fileobj=raw) if Path(file).suffix == ".gz" else raw
+            yield from FastqIO.stream(handle, chunk_size)
+        return
+
     # FASTQ generator
     def read(handle: TextIOWrapper) -> SeqFastq:
         # reading from the handle
@@ -45,38 +168,138 @@ class FastqIO:
     def write(handle: TextIOWrapper, record: SeqFastq) -> None:
         handle.write(str(record))
         return
+
+    # index of `file` (see `FastqIndex`), built in a single pass and saved
+    # if missing or out of date
+    def index(file: str) -> FastqIndex:
+        index = FastqIndex.cached(file)
+        if index is not None:
+            return index
+        fingerprint = FastqIndex.fingerprint(file)
+        parts = []
+        size = 0
+        for start, size, data in FastqIO.stream_file(file):
+            starts, _, lengths, hashes = FastqIndex.record_bounds(data)
+            parts.append((starts + start, lengths, hashes))
+        index = FastqIndex.concat(parts, size, fingerprint)
+        FastqIndex.store(file, index)
+        return index
+
+    # sample `n` FASTQ records (in file order) -> (records, number of records)
+    #
+    # Records are drawn by reservoir sampling in a single pass, seeded by
+    # `seed` (the draws do not depend on how the input is chunked), and the
+    # pass also saves the index of the file (see `FastqIndex`). With an up
+    # to date index, the same records are drawn from the index and read by
+    # their offsets instead. Only the first `fraction` of the file (on-disk
+    # bytes) is scanned if `fraction` < 1, and the number of records is
+    # then extrapolated. With `approximate`, records are taken at `n` random
+    # byte offsets of plain or BGZF files instead (the record after each
+    # offset, so records after long ones are favoured) and the number of
+    # records is estimated.
+    def sample(
+            file: str,
+            n: int,
+            seed: int = 42,
+            fraction: float = 1,
+            approximate: bool = False
+        ) -> Tuple[List[SeqFastqView], int]:
+        index = FastqIndex.cached(file) if fraction >= 1 else None
+        if index is not None:
+            return FastqIO.sample_index(file, index, n, seed)
+        if approximate and FastqIO.offset_sampling(file, n):
+            return FastqIO.sample_offsets(file, n, seed)
+        rng = np.random.default_rng(seed)
+        fingerprint = FastqIndex.fingerprint(file)
+        budget = fraction * os.path.getsize(file)
+        kept = {}  # slot of the reservoir -> (record number, record)
+        parts = []  # (offsets, read lengths) of the records of each chunk
+        count = size = 0
+        with open(file, "rb") as raw:
+            handle = gzip.GzipFile(fileobj=raw) if Path(file).suffix == ".gz" else raw
+            for start, size, data in FastqIO.stream(handle, 1 << 24):
+                starts, ends, lengths, hashes = FastqIndex.record_bounds(data)
+                parts.append((starts + start, lengths, hashes))
+                slots = FastqIO.reservoir(rng, count, len(starts), n)
+                for k in np.flatnonzero(slots < n).tolist():
+                    kept[int(slots[k])] = (count + k, data[starts[k]:ends[k]])
+                count += len(starts)
+                if fraction < 1 and raw.tell() >= budget:
+                    count = int(round(count * os.path.getsize(file) / raw.tell()))
+                    break
+            else:
+                FastqIndex.store(file, FastqIndex.concat(parts, size, fingerprint))
+        # lazy views of the sampled records (in one buffer)
+        records = [record for _, record in sorted(kept.values(), key=lambda x: x[0])]
+        return list(FastqIO.scan(b"".join(records))), count
+
+    # reservoir slots of records `count`, ..., `count + m - 1` (slots >= `n`:
+    # not kept); record `i` replaces a random slot with probability n / (i + 1)
+    def reservoir(rng: np.random.Generator, count: int, m: int, n: int) -> np.ndarray:
+        idx = count + np.arange(m)
+        return np.where(idx < n, idx, (rng.random(m) * (idx + 1)).astype(np.int64))
+
+    # `FastqIO.sample` with the index of the file (same records)
+    def sample_index(file: str, index: FastqIndex, n: int, seed: int = 42) -> Tuple[List[SeqFastqView], int]:
+        rng = np.random.default_rng(seed)
+        kept = np.zeros(min(n, len(index)), dtype=np.int64)
+        for count in range(0, len(index), 1 << 24):
+            m = min(1 << 24, len(index) - count)
+            slots = FastqIO.reservoir(rng, count, m, n)
+            # later records replace earlier ones in the same slot
+            keep = np.flatnonzero(slots < n)[::-1]
+            _, last = np.unique(slots[keep], return_index=True)
+            kept[slots[keep[last]]] = count + keep[last]
+        records = FastqIO.read_ranges(file, *index.ranges(np.sort(kept)))
+        return list(FastqIO.scan(b"".join(records))), len(index)
+
+    # whether `n` records can be sampled by byte offsets (random access
+    # without decompressing from the start, and fewer records than the file)
+    def offset_sampling(file: str, n: int) -> bool:
+        if not FastqIO.random_access(file):
+            return False
+        size = FastqIO.record_size(file)
+        return size > 0 and n < FastqIO.size(file) / size
+
+    # sample records at `n` random byte offsets (see `FastqIO.sample`)
+    def sample_offsets(file: str, n: int, seed: int = 42) -> Tuple[List[SeqFastqView], int]:
+        size = FastqIO.size(file)
+        offsets = np.sort(np.random.default_rng(seed).integers(0, size, n))
+        records = []
+        last = -1
+        with FastqIO.openb(file) as handle:
+            for offset in offsets.tolist():
+                start = FastqIO.resync(handle, offset)
+                # offsets within the same record yield it once
+                if start == last or start >= size:
+                    continue
+                last = start
+                handle.seek(start)
+                records.append(b"".join(handle.readline() for _ in range(4)))
+        return list(FastqIO.scan(b"".join(records))), int(round(size / FastqIO.record_size(file)))
     
-    # sample FASTQ file
-    def sample(file: str, n: int, seed: int = 42) -> list:
-        # get number of lines
-        with FastqIO.openg(file, "r") as handle:
-            for nlines, line in enumerate(handle):
-                pass
-               
-        # sample lines
-        num_reads = (nlines + 1) // 4 # integer division to avoid float
-        random.seed(seed)
-        randidx = random.sample(range(num_reads), min(n, num_reads))
-        randidx = set(randidx)
-        
-        # get FASTQ records
-        res = []
-        fq_lines = []
-        keep_lines = 0
-        with FastqIO.openg(file, "r") as handle_in:
-            for line_num, line in enumerate(handle_in):
-                if line_num % 4 == 0:
-                    idx = line_num / 4
-                    if idx in randidx:
-                        keep_lines = 4
-                if keep_lines > 0:
-                    fq_lines.append(line)
-                    keep_lines -= 1
-                    if keep_lines == 0:
-                        res.append(SeqFastq.parse(*fq_lines))
-                        fq_lines = []
-        return res, num_reads
-    
+    # bytes of the byte ranges [starts[i], ends[i]) (sorted by start) of the
+    # (decompressed) file; other gzip files are decompressed up to the last
+    # range once
+    def read_ranges(file: str, starts: np.ndarray, ends: np.ndarray) -> List[bytes]:
+        if Path(file).suffix != ".gz":
+            buf = FastqIO.mmap(file)
+            return [buf[start:end] for start, end in zip(starts.tolist(), ends.tolist())]
+        out = []
+        with FastqIO.openb(file) if FastqIO.random_access(file) else gzip.open(file, "rb") as handle:
+            for start, end in zip(starts.tolist(), ends.tolist()):
+                handle.seek(start)
+                out.append(handle.read(end - start))
+        return out
+
+    # whether byte ranges can be read without decompressing from the start
+    # of the file (uncompressed or BGZF)
+    def random_access(file: str) -> bool:
+        if Path(file).suffix != ".gz":
+            return True
+        with open(file, "rb") as handle:
+            return GzipIndexIO.bgzf_block_size(handle.read(18)) > 0
+
     @staticmethod
     def openg(p:str, mode:str):
         p = Path(p) if not isinstance(p, Path) else p
@@ -84,13 +307,32 @@ class FastqIO:
             return gzip.open(p, mode + "t")
         else:
             return open(p, mode)
+
+    # open FASTQ file in binary mode (seekable)
+    @staticmethod
+    def openb(p:str):
+        p = Path(p) if not isinstance(p, Path) else p
+        if p.suffix == ".gz":
+            return GzipIndexIO(p)
+        else:
+            return open(p, "rb")
         
 
 class FastqIndexIO:
+    """Random access to the records of a FASTQ file by read name
+
+    Read names (up to the first whitespace) are looked up by their hashes
+    in the index of the file (see `FastqIndex`, saved next to the input and
+    reused while it is up to date); hash collisions are resolved by
+    comparing the names of the candidate records on disk.
+    """
     def __init__(self, file: str) -> None:
         self.file = file
-        self.names, self.offsets = FastqIndexIO.fqidx(file)
+        self.index = FastqIO.index(file)
         return
+
+    def __len__(self) -> int:
+        return len(self.index)
         
     @staticmethod
     def openg(p:str, mode:str):
@@ -99,39 +341,44 @@ class FastqIndexIO:
             return gzip.open(p, mode + "t")
         else:
             return open(p, mode)
-        
-    # index FASTQ file
+
+    # read name of a FASTQ record (bytes)
     @staticmethod
-    def fqidx(file: str) -> dict:
-        # index the handle
-        ordered_keys = []
-        offsets = {}
-        with FastqIndexIO.openg(file, "r") as handle:
-            while True:
-                offset = handle.tell()
-                identifier = handle.readline().strip()
-                if len(identifier) == 0:
-                    break
-                ordered_keys.append(identifier[1:])
-                offsets[identifier[1:]] = offset
-                handle.readline()
-                handle.readline()
-                handle.readline()
-        return ordered_keys, offsets
+    def name(record: bytes) -> bytes:
+        header = record[1:record.find(b"\n")]
+        return (header.split(maxsplit=1) or [b""])[0]
     
-    # get SeqFastq by index
+    # get SeqFastq by read name
     def get(self, name: str) -> SeqFastq:
-        with FastqIndexIO.openg(self.file, "r") as handle:
-            handle.seek(self.offsets[name])
-            return SeqFastq.parse(
-                handle.readline(),
-                handle.readline(),
-                handle.readline(),
-                handle.readline()
-            )
+        record, = self.get_many([name])
+        if record is None:
+            raise KeyError(name)
+        return record
+
+    # get SeqFastq of each read name (None if not found), in request order
+    def get_many(self, names: List[str]) -> List[SeqFastq]:
+        return [
+            next(FastqIO.scan(record)) if record is not None else None
+            for record in self.records(names)
+        ]
+
+    # FASTQ record (bytes) of each read name (None if not found); records
+    # are read in file order through one handle (or memory map)
+    def records(self, names: List[str]) -> List[bytes]:
+        names = [(name.encode().split(maxsplit=1) or [b""])[0] for name in names]
+        candidates, which = self.index.lookup(names)
+        # records are read once (also for repeated names)
+        unique, inverse = np.unique(candidates, return_inverse=True)
+        data = FastqIO.read_ranges(self.file, *self.index.ranges(unique))
+        out = [None] * len(names)
+        for i, k in zip(which.tolist(), inverse.tolist()):
+            # hash collisions: candidates with other names are skipped
+            if out[i] is None and FastqIndexIO.name(data[k]) == names[i]:
+                out[i] = data[k]
+        return out
     
-    # iter
+    # iter (in a single pass over the file)
     def __iter__(self):
-        for name in self.names:
-            yield self.get(name)
-        return
\ No newline at end of file
+        for _, _, data in FastqIO.stream_file(self.file):
+            yield from FastqIO.scan(data)
+        return
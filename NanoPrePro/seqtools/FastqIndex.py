@@ -0,0 +1,214 @@
+"""Persistent index of the records of a FASTQ file (`.fqi`)"""
+from pathlib import Path
+from typing import List, Tuple
+import numpy as np
+import hashlib, os
+
+# first word of `.fqi` files
+MAGIC = int.from_bytes(b"NPP.FQI2", "little")
+# bytes hashed at each end of the file for the fingerprint
+FINGERPRINT_BYTES = 1 << 16
+# multiplier of the polynomial hash of read names
+HASH_BASE = np.uint64(0x100000001B3)
+
+
+class FastqIndex:
+    """Record offsets, read lengths and read name hashes of a FASTQ file
+
+    The index is stored next to the input (`<input>.fqi`) as little-endian
+    uint64 header words (magic, file size, mtime in ns, hash of the first
+    and last 64 KiB, number of records `n`) followed by
+
+    - `offsets`: uint64[n + 1], record offsets (in decompressed bytes for
+      gzip inputs) and the size of the (decompressed) file
+    - `hashes`: uint64[n], sorted 64-bit hashes of the read names (up to
+      the first whitespace)
+    - `lengths`: uint32[n], read lengths
+    - `order`: uint32[n], record number of each hash
+
+    and is loaded through a read-only memory map. It is rebuilt when the
+    fingerprint (size, mtime and hash) no longer matches the input.
+    """
+    _cache = {}
+
+    def __init__(
+            self,
+            offsets: np.ndarray,
+            lengths: np.ndarray,
+            hashes: np.ndarray,
+            order: np.ndarray,
+            fingerprint: tuple
+        ) -> None:
+        self.offsets = offsets
+        self.lengths = lengths
+        self.hashes = hashes
+        self.order = order
+        self.fingerprint = fingerprint
+        return
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    # size (bytes) of the (decompressed) FASTQ file
+    def size(self) -> int:
+        return int(self.offsets[-1])
+
+    # byte ranges of records `idx` -> (starts, ends)
+    def ranges(self, idx: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        idx = np.asarray(idx, dtype=np.int64)
+        return self.offsets[idx], self.offsets[idx + 1]
+
+    # records whose names hash like `names` -> (records, number of the
+    # name of each record); the caller resolves hash collisions
+    def lookup(self, names: List[bytes]) -> Tuple[np.ndarray, np.ndarray]:
+        hashes = FastqIndex.hash_names(names)
+        lo = np.searchsorted(self.hashes, hashes, side="left")
+        counts = np.searchsorted(self.hashes, hashes, side="right") - lo
+        which = np.repeat(np.arange(len(names)), counts)
+        # positions lo[i], ..., hi[i] - 1 of every name
+        pos = np.arange(len(which)) + np.repeat(lo - (np.cumsum(counts) - counts), counts)
+        return self.order[pos].astype(np.int64), which
+
+    # the index of `file` if it is up to date (None otherwise)
+    @staticmethod
+    def cached(file: str) -> "FastqIndex":
+        file = str(file)
+        fingerprint = FastqIndex.fingerprint(file)
+        if file in FastqIndex._cache and FastqIndex._cache[file].fingerprint == fingerprint:
+            return FastqIndex._cache[file]
+        path = Path(file + ".fqi")
+        index = FastqIndex.load(path) if path.exists() else None
+        if index is None or index.fingerprint != fingerprint:
+            return None
+        FastqIndex._cache[file] = index
+        return index
+
+    # save the index of `file` (if the directory is writable)
+    @staticmethod
+    def store(file: str, index: "FastqIndex") -> None:
+        file = str(file)
+        try:
+            FastqIndex.save(Path(file + ".fqi"), index)
+        except OSError:
+            pass
+        FastqIndex._cache[file] = index
+        return
+
+    # (size, mtime, hash of the first and last 64 KiB) of `file`
+    @staticmethod
+    def fingerprint(file: str) -> tuple:
+        stat = os.stat(file)
+        digest = hashlib.blake2b(digest_size=8)
+        with open(file, "rb") as handle:
+            digest.update(handle.read(FINGERPRINT_BYTES))
+            handle.seek(max(stat.st_size - FINGERPRINT_BYTES, 0))
+            digest.update(handle.read(FINGERPRINT_BYTES))
+        return stat.st_size, stat.st_mtime_ns, int.from_bytes(digest.digest(), "little")
+
+    @staticmethod
+    def load(path: str) -> "FastqIndex":
+        if os.path.getsize(path) < 40:
+            return None
+        raw = np.memmap(path, dtype=np.uint8, mode="r")
+        header = raw[:40].view("<u8")
+        n = int(header[4])
+        if header[0] != MAGIC or len(raw) != 40 + 24 * n + 8:
+            return None
+        sections = np.cumsum([40, 8 * (n + 1), 8 * n, 4 * n, 4 * n]).tolist()
+        return FastqIndex(
+            offsets=raw[sections[0]:sections[1]].view("<u8"),
+            hashes=raw[sections[1]:sections[2]].view("<u8"),
+            lengths=raw[sections[2]:sections[3]].view("<u4"),
+            order=raw[sections[3]:sections[4]].view("<u4"),
+            fingerprint=tuple(int(x) for x in header[1:4])
+        )
+
+    # written to a temporary file first (the old index may be memory-mapped)
+    @staticmethod
+    def save(path: str, index: "FastqIndex") -> None:
+        tmp = Path(str(path) + ".tmp")
+        with open(tmp, "wb") as handle:
+            handle.write(np.array([MAGIC, *index.fingerprint, len(index)], dtype="<u8").tobytes())
+            handle.write(index.offsets.astype("<u8").tobytes())
+            handle.write(index.hashes.astype("<u8").tobytes())
+            handle.write(index.lengths.astype("<u4").tobytes())
+            handle.write(index.order.astype("<u4").tobytes())
+        os.replace(tmp, path)
+        return
+
+    # index from the records of each chunk of the file ((offsets, read
+    # lengths, name hashes) from `FastqIndex.record_bounds`) and the size
+    # of the file
+    @staticmethod
+    def concat(parts: list, size: int, fingerprint: tuple) -> "FastqIndex":
+        hashes = np.concatenate([part[2] for part in parts] + [np.zeros(0, dtype=np.uint64)])
+        order = np.argsort(hashes, kind="stable")
+        return FastqIndex(
+            offsets=np.concatenate([part[0] for part in parts] + [[size]]).astype(np.uint64),
+            lengths=np.concatenate([part[1] for part in parts] + [np.zeros(0, dtype=np.int64)]).astype(np.uint32),
+            hashes=hashes[order],
+            order=order.astype(np.uint32),
+            fingerprint=fingerprint
+        )
+
+    # (start, end, read length, name hash) of the FASTQ records in a
+    # record-aligned chunk
+    @staticmethod
+    def record_bounds(data: bytes) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        buf = np.frombuffer(data, dtype=np.uint8)
+        newlines = np.flatnonzero(buf == 10)
+        ends = newlines[3::4] + 1
+        # last record without a trailing line break
+        if len(newlines) % 4 == 3 and data[-1:] != b"\n":
+            ends = np.append(ends, len(data))
+        starts = np.concatenate([[0], ends])[:len(ends)].astype(np.int64)
+        # sequence lines (without "\r")
+        seq_starts = newlines[0::4][:len(ends)] + 1
+        seq_ends = newlines[1::4][:len(ends)]
+        seq_ends = seq_ends - (buf[np.maximum(seq_ends - 1, 0)] == 13)
+        # read names (after "@", up to the first whitespace of the header)
+        header_ends = seq_starts - 1
+        header_ends = np.maximum(header_ends - (buf[np.maximum(header_ends - 1, 0)] == 13), starts + 1)
+        headers, offsets = FastqIndex.gather(buf, starts + 1, header_ends)
+        spaces = np.append(np.flatnonzero((headers == 32) | (headers == 9)), len(headers))
+        name_ends = np.minimum(spaces[np.searchsorted(spaces, offsets[:-1])], offsets[1:])
+        return starts, ends, np.maximum(seq_ends - seq_starts, 0), \
+            FastqIndex.hash(headers, offsets[:-1], name_ends)
+
+    # hashes of read names (names are cut at the first whitespace)
+    @staticmethod
+    def hash_names(names: List[bytes]) -> np.ndarray:
+        names = [(name.split(maxsplit=1) or [b""])[0] for name in names]
+        lengths = np.array([len(name) for name in names], dtype=np.int64)
+        ends = np.cumsum(lengths)
+        return FastqIndex.hash(np.frombuffer(b"".join(names), dtype=np.uint8), ends - lengths, ends)
+
+    # 64-bit hashes of buf[starts[i]:ends[i]]: polynomial hash of the bytes
+    # (modulo 2 ** 64) plus the length, mixed by the splitmix64 finalizer
+    @staticmethod
+    def hash(buf: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        data, offsets = FastqIndex.gather(buf, starts, ends)
+        lengths = np.diff(offsets)
+        # power of the base of every byte (its distance to the end)
+        powers = np.ones(int(lengths.max(initial=0)) + 1, dtype=np.uint64)
+        np.cumprod(np.full(len(powers) - 1, HASH_BASE), out=powers[1:])
+        distance = np.repeat(offsets[1:], lengths) - 1 - np.arange(len(data))
+        terms = data.astype(np.uint64) * powers[distance]
+        x = lengths.astype(np.uint64)
+        nonempty = np.flatnonzero(lengths)
+        if len(nonempty):
+            x[nonempty] += np.add.reduceat(terms, offsets[nonempty])
+        x ^= x >> np.uint64(30)
+        x *= np.uint64(0xBF58476D1CE4E5B9)
+        x ^= x >> np.uint64(27)
+        x *= np.uint64(0x94D049BB133111EB)
+        x ^= x >> np.uint64(31)
+        return x
+
+    # concatenate buf[starts[i]:ends[i]] -> (bytes, offsets)
+    @staticmethod
+    def gather(buf: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        lengths = ends - starts
+        offsets = np.zeros(len(starts) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return buf[np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])], offsets
@@ -0,0 +1,169 @@
+"""Random access to gzip/BGZF files through a `.gzi` index"""
+from pathlib import Path
+import numpy as np
+import gzip, os, struct, zlib
+
+
+class GzipIndexIO:
+    """Seekable binary reader of gzip/BGZF files
+
+    The index holds the (compressed, uncompressed) offsets of every gzip
+    member, stored next to the input in the `.gzi` format of `bgzip`
+    (uint64 number of entries followed by uint64 offset pairs; the first
+    member at (0, 0) is implicit). BGZF blocks are indexed from their
+    headers without decompression, other gzip files are decompressed once.
+    Seeking only decompresses from the closest member start, so concurrent
+    readers can start at their own slice of the file.
+    """
+    _cache = {}
+
+    def __init__(self, file: str) -> None:
+        self.file = str(file)
+        self.index = GzipIndexIO.index(self.file)
+        self.handle = open(self.file, "rb")
+        self.stream = None
+        self.start = 0
+        self.seek(0)
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+        return
+
+    def __iter__(self):
+        return iter(self.stream)
+
+    def close(self) -> None:
+        self.stream.close()
+        self.handle.close()
+        return
+
+    def seek(self, offset: int) -> int:
+        # start decompressing from the closest member before `offset`
+        i = np.searchsorted(self.index[:, 1], offset, side="right") - 1
+        coffset, uoffset = (int(x) for x in self.index[i])
+        # read on if that member starts before the current position
+        if self.stream is not None and uoffset <= self.tell() <= offset:
+            self.stream.seek(offset - self.start)
+            return offset
+        self.handle.seek(coffset)
+        self.stream = gzip.GzipFile(fileobj=self.handle, mode="rb")
+        self.stream.seek(offset - uoffset)
+        self.start = uoffset
+        return offset
+
+    def tell(self) -> int:
+        return self.start + self.stream.tell()
+
+    def read(self, size: int = -1) -> bytes:
+        return self.stream.read(size)
+
+    def readline(self, size: int = -1) -> bytes:
+        return self.stream.readline(size)
+
+    # size of the decompressed file
+    def size(self) -> int:
+        coffset, uoffset = (int(x) for x in self.index[-1])
+        if coffset == os.path.getsize(self.file):
+            return uoffset
+        # index without a terminal entry (e.g. written by `bgzip`)
+        size = self.seek(uoffset)
+        while True:
+            chunk = self.read(1 << 24)
+            if not chunk:
+                break
+            size += len(chunk)
+        return size
+
+    # load (or build and save) the index of `file`
+    @staticmethod
+    def index(file: str) -> np.ndarray:
+        mtime = os.path.getmtime(file)
+        if file in GzipIndexIO._cache and GzipIndexIO._cache[file][0] == mtime:
+            return GzipIndexIO._cache[file][1]
+        path = Path(file + ".gzi")
+        if path.exists() and path.stat().st_mtime >= mtime:
+            index = GzipIndexIO.load(path)
+        else:
+            index = GzipIndexIO.build(file)
+            try:
+                GzipIndexIO.save(path, index)
+            except OSError:
+                pass
+        GzipIndexIO._cache[file] = (mtime, index)
+        return index
+
+    @staticmethod
+    def load(path: str) -> np.ndarray:
+        raw = np.fromfile(path, dtype="<u8")
+        n = int(raw[0])
+        return np.vstack([
+            np.zeros((1, 2), dtype=np.uint64),
+            raw[1:1 + 2 * n].reshape(n, 2).astype(np.uint64)
+        ])
+
+    # written to a temporary file first (an interrupted run leaves no
+    # truncated index behind)
+    @staticmethod
+    def save(path: str, index: np.ndarray) -> None:
+        tmp = Path(str(path) + ".tmp")
+        with open(tmp, "wb") as handle:
+            handle.write(struct.pack("<Q", len(index) - 1))
+            handle.write(index[1:].astype("<u8").tobytes())
+        os.replace(tmp, path)
+        return
+
+    # index gzip members; the last entry marks the end of the file
+    @staticmethod
+    def build(file: str) -> np.ndarray:
+        offsets = [(0, 0)]
+        coffset = uoffset = 0
+        size = os.path.getsize(file)
+        with open(file, "rb") as handle:
+            while coffset < size:
+                handle.seek(coffset)
+                header = handle.read(18)
+                # trailing garbage (e.g. zero padding) is ignored
+                if header[:2] != b"\x1f\x8b":
+                    break
+                bsize = GzipIndexIO.bgzf_block_size(header)
+                if bsize:
+                    handle.seek(coffset + bsize - 4)
+                    csize, isize = bsize, struct.unpack("<I", handle.read(4))[0]
+                else:
+                    csize, isize = GzipIndexIO.inflate_member(handle, coffset)
+                coffset += csize
+                uoffset += isize
+                offsets.append((coffset, uoffset))
+        return np.array(offsets, dtype=np.uint64)
+
+    # size of a BGZF block (0 if the header is not a BGZF header)
+    @staticmethod
+    def bgzf_block_size(header: bytes) -> int:
+        if len(header) < 18 or not header[3] & 4:
+            return 0
+        if header[12:14] != b"BC" or struct.unpack("<H", header[14:16])[0] != 2:
+            return 0
+        return struct.unpack("<H", header[16:18])[0] + 1
+
+    # decompress a gzip member to get its compressed/decompressed sizes
+    @staticmethod
+    def inflate_member(handle, coffset: int):
+        handle.seek(coffset)
+        inflater = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        csize = isize = 0
+        while not inflater.eof:
+            chunk = handle.read(1 << 20)
+            if not chunk:
+                raise EOFError(
+                    "Compressed file ended before the "
+                    "end-of-stream marker was reached"
+                )
+            csize += len(chunk)
+            while chunk and not inflater.eof:
+                isize += len(inflater.decompress(chunk, 1 << 24))
+                chunk = inflater.unconsumed_tail
+        return csize - len(inflater.unused_data), isize
@@ -0,0 +1,83 @@
+"""Mergeable fixed-bin histograms of per-read statistics"""
+import numpy as np
+
+
+class Histogram(object):
+    """Histogram with fixed bin edges, mergeable across processes
+
+    `counts[0]` and `counts[-1]` count the values below the first and at or
+    above the last edge. The count, sum, minimum and maximum of the values
+    are kept exactly; quantiles are interpolated within bins, so their error
+    is at most one bin width (relative error with `Histogram.log` bins).
+    Memory does not depend on the number of values added.
+    """
+    def __init__(self, edges: np.ndarray) -> None:
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.counts = np.zeros(len(self.edges) + 1, dtype=np.int64)
+        self.total = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        return
+
+    def __len__(self) -> int:
+        return int(self.counts.sum())
+
+    def __iadd__(self, other: "Histogram") -> "Histogram":
+        return self.merge(other)
+
+    # `n` bins of equal width in [lo, hi)
+    @staticmethod
+    def linear(lo: float, hi: float, n: int) -> "Histogram":
+        return Histogram(np.linspace(lo, hi, n + 1))
+
+    # `per_decade` bins per power of 10 in [lo, hi)
+    @staticmethod
+    def log(lo: float, hi: float, per_decade: int) -> "Histogram":
+        n = int(round(np.log10(hi / lo) * per_decade))
+        return Histogram(np.geomspace(lo, hi, n + 1))
+
+    def add(self, values: np.ndarray) -> None:
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return
+        self.counts += np.bincount(
+            np.searchsorted(self.edges, values, side="right"),
+            minlength=len(self.counts)
+        )
+        self.total += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        return
+
+    def merge(self, other: "Histogram") -> "Histogram":
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError("Cannot merge histograms with different bins")
+        self.counts += other.counts
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def mean(self) -> float:
+        return self.total / len(self) if len(self) else np.nan
+
+    # approximate q-th quantile(s) (0 <= q <= 1)
+    def quantile(self, q):
+        if len(self) == 0:
+            return np.full(np.shape(q), np.nan)[()]
+        # bounds of every bin (outer bins end at the minimum/maximum)
+        lo = np.concatenate([[self.min], self.edges])
+        hi = np.concatenate([self.edges, [self.max]])
+        lo, hi = np.clip(lo, self.min, self.max), np.clip(hi, self.min, self.max)
+        # bin holding the rank, then linear interpolation within the bin
+        cum = np.cumsum(self.counts)
+        rank = np.asarray(q, dtype=np.float64) * len(self)
+        i = np.minimum(np.searchsorted(cum, rank, side="left"), len(cum) - 1)
+        before = cum[i] - self.counts[i]
+        frac = np.clip((rank - before) / np.maximum(self.counts[i], 1), 0, 1)
+        return (lo[i] + frac * (hi[i] - lo[i]))[()]
+
+    # (left edges, right edges, counts) of the bins between the first and
+    # last edges
+    def bins(self) -> tuple:
+        return self.edges[:-1], self.edges[1:], self.counts[1:-1]
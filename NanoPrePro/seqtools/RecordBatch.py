@@ -0,0 +1,257 @@
+"""Columnar container of NanoPreP-styled FASTQ records"""
+from NanoPrePro.seqtools.SeqFastq import SeqAnnot, PHRED_ERROR, COMPLEMENT_BYTES
+from numpy.lib.stride_tricks import sliding_window_view
+from typing import Iterator, List
+import numpy as np
+
+# complement of each byte (see `SeqFastq.reverse_complement_static`)
+COMPLEMENT = np.frombuffer(COMPLEMENT_BYTES, dtype=np.uint8)
+
+
+class RecordBatch(object):
+    """Batch of FASTQ records stored as contiguous buffers and columns
+
+    Sequences and qualities are concatenated into `seq` and `qual`
+    (uint8 arrays) with read `i` stored at `offsets[i]:offsets[i + 1]`;
+    read names (`ids`) and comment lines (`id2s`) are stored alike.
+    Trimming only moves the current bounds of each read (`starts`/`ends`).
+    The fields of `SeqAnnot` are stored as one NumPy column each.
+    """
+    def __init__(
+        self,
+        ids: np.ndarray,
+        id_offsets: np.ndarray,
+        seq: np.ndarray,
+        qual: np.ndarray,
+        offsets: np.ndarray,
+        id2s: np.ndarray = None,
+        id2_offsets: np.ndarray = None
+    ) -> None:
+        n = len(offsets) - 1
+        self.ids = ids
+        self.id_offsets = id_offsets
+        self.seq = seq
+        self.qual = qual
+        self.offsets = offsets
+        self.id2s = id2s if id2s is not None else np.zeros(0, dtype=np.uint8)
+        self.id2_offsets = id2_offsets if id2_offsets is not None \
+            else np.zeros(n + 1, dtype=np.int64)
+        # current bounds of the reads (moved by trimming)
+        self.starts = offsets[:-1].copy()
+        self.ends = offsets[1:].copy()
+        # annotation columns (see `SeqAnnot` for the defaults)
+        self.strand = np.zeros(n, dtype=np.float64)
+        self.orientation = np.ones(n, dtype=np.int8)
+        self.full_length = np.zeros(n, dtype=np.int8)
+        self.fusion = np.zeros(n, dtype=np.int8)
+        self.ploc5 = np.full(n, -1, dtype=np.int64)
+        self.ploc3 = np.full(n, -1, dtype=np.int64)
+        self.poly5 = np.zeros(n, dtype=np.int64)
+        self.poly3 = np.zeros(n, dtype=np.int64)
+        # cached mean Q-scores (NaN: not computed for the current bounds)
+        self._meanq = np.full(n, np.nan)
+        pass
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def lengths(self) -> np.ndarray:
+        return self.ends - self.starts
+
+    def sequence(self, i: int) -> str:
+        return self.seq[self.starts[i]:self.ends[i]].tobytes().decode()
+
+    def name(self, i: int) -> str:
+        return self.ids[self.id_offsets[i]:self.id_offsets[i + 1]].tobytes().decode()
+
+    def set_annot(self, i: int, annot: SeqAnnot) -> None:
+        self.strand[i] = annot.strand
+        self.orientation[i] = annot.orientation
+        self.full_length[i] = annot.full_length
+        self.fusion[i] = annot.fusion
+        self.ploc5[i] = annot.ploc5
+        self.ploc3[i] = annot.ploc3
+        self.poly5[i] = annot.poly5
+        self.poly3[i] = annot.poly3
+        return
+
+    # reverse complement reads `idx` in place (see `SeqFastq.reverse_complement`)
+    def reverse_complement(self, idx: np.ndarray) -> None:
+        for _, pos, rev in self.positions(idx):
+            self.seq[pos] = COMPLEMENT[self.seq[rev]]
+            self.qual[pos] = self.qual[rev]
+
+        # annot
+        n = self.lengths()[idx]
+        ploc5, ploc3 = self.ploc5[idx], self.ploc3[idx]
+        poly5, poly3 = self.poly5[idx], self.poly3[idx]
+        self.orientation[idx] *= -1
+        self.ploc3[idx] = np.where(ploc5 > 0, n - ploc5, ploc5)
+        self.ploc5[idx] = np.where(ploc3 > 0, n - ploc3, ploc3)
+        self.poly5[idx] = poly3
+        self.poly3[idx] = poly5
+        return
+
+    # trim reads to [starts + a, starts + b) (`a` <= `b`, relative to the current bounds)
+    def trim(self, a: np.ndarray, b: np.ndarray) -> None:
+        starts, ends = self.starts + a, self.starts + b
+        changed = (starts != self.starts) | (ends != self.ends)
+        self.starts, self.ends = starts, ends
+        self._meanq[changed] = np.nan
+        return
+
+    # mean Q-score of each read (see `SeqFastq.meanq`); cached until trimmed
+    def meanq(self, chunk_size: int = 1 << 22) -> np.ndarray:
+        todo = np.flatnonzero(np.isnan(self._meanq))
+        lengths = self.lengths()
+        self._meanq[todo[lengths[todo] == 0]] = 0
+        todo = todo[lengths[todo] > 0]
+        for idx, pos, _ in self.positions(todo, chunk_size):
+            # ascii -> p -> mean p -> mean q
+            n = lengths[idx]
+            first = np.cumsum(n) - n
+            mean_p = np.add.reduceat(PHRED_ERROR[self.qual[pos]], first) / n
+            self._meanq[idx] = -10 * np.log10(mean_p)
+        return self._meanq.copy()
+
+    # `seq[a:b]` of reads `idx` (relative to the current bounds, as in
+    # `read.seq[a:b]`) as the rows of a matrix padded with 0
+    def slices(self, a: int, b: int, idx: np.ndarray) -> np.ndarray:
+        n = self.lengths()[idx]
+        a = np.clip(np.where(a < 0, a + n, a), 0, n)
+        b = np.clip(np.where(b < 0, b + n, b), 0, n)
+        w = np.maximum(b - a, 0)
+        width = w.max(initial=0)
+        seq = np.concatenate([self.seq, np.zeros(width, dtype=np.uint8)])
+        out = sliding_window_view(seq, width)[self.starts[idx] + a]
+        out[np.arange(width) >= w[:, np.newaxis]] = 0
+        return out
+
+    # positions of the bases of reads `idx` in `seq`/`qual` (and the same
+    # positions with each read reversed), in chunks of about `chunk_size` bases
+    def positions(self, idx: np.ndarray, chunk_size: int = 1 << 22) -> Iterator[tuple]:
+        lengths = self.lengths()
+        total = np.cumsum(lengths[idx])
+        cuts = np.searchsorted(total, np.arange(chunk_size, total[-1] if len(total) else 0, chunk_size))
+        for chunk in np.split(idx, np.unique(cuts)):
+            n = lengths[chunk]
+            if n.sum() == 0:
+                continue
+            offset = np.repeat(self.starts[chunk] - (np.cumsum(n) - n), n)
+            pos = np.arange(n.sum()) + offset
+            rev = np.repeat(self.starts[chunk] + self.ends[chunk] - 1, n) - pos
+            yield chunk, pos, rev
+        return
+
+    # records (or records `idx`) in FASTQ format (see `SeqFastq.__str__`)
+    def to_fastq(self, idx: np.ndarray = None) -> bytes:
+        out = []
+        idx = np.arange(len(self)) if idx is None else idx
+        annots = zip(
+            idx.tolist(),
+            (self.strand * self.orientation)[idx].tolist(),
+            self.full_length[idx].tolist(),
+            self.fusion[idx].tolist(),
+            self.ploc5[idx].tolist(),
+            self.ploc3[idx].tolist(),
+            self.poly5[idx].tolist(),
+            self.poly3[idx].tolist()
+        )
+        seq, qual = self.seq.tobytes(), self.qual.tobytes()
+        ids, id2s = self.ids.tobytes(), self.id2s.tobytes()
+        starts, ends = self.starts.tolist(), self.ends.tolist()
+        id_offsets, id2_offsets = self.id_offsets.tolist(), self.id2_offsets.tolist()
+        for i, *annot in annots:
+            name = ids[id_offsets[i]:id_offsets[i + 1]]
+            out += [
+                b"@", name, b" " if name else b"",
+                ((
+                    "strand=%.2f "
+                    "full_length=%s "
+                    "fusion=%s "
+                    "ploc5=%s "
+                    "ploc3=%s "
+                    "poly5=%s "
+                    "poly3=%s"
+                ) % tuple(annot)).encode(),
+                b"\n", seq[starts[i]:ends[i]],
+                b"\n+", id2s[id2_offsets[i]:id2_offsets[i + 1]],
+                b"\n", qual[starts[i]:ends[i]], b"\n"
+            ]
+        return b"".join(out)
+
+    # split reads `idx` into groups of about `nbytes` in FASTQ format
+    def split(self, idx: np.ndarray, nbytes: int) -> List[np.ndarray]:
+        size = 2 * (self.ends - self.starts)[idx] + \
+            np.diff(self.id_offsets)[idx] + np.diff(self.id2_offsets)[idx] + 96
+        total = np.cumsum(size)
+        cuts = np.searchsorted(total, np.arange(nbytes, total[-1] if len(total) else 0, nbytes))
+        return [group for group in np.split(idx, np.unique(cuts)) if len(group)]
+
+    # concatenate buf[starts[i]:ends[i]] (and other[starts[i]:ends[i]])
+    @staticmethod
+    def gather(buf: np.ndarray, starts: np.ndarray, ends: np.ndarray, other: np.ndarray = None):
+        mask = RecordBatch.mask(len(buf), starts, ends)
+        offsets = np.zeros(len(starts) + 1, dtype=np.int64)
+        np.cumsum(ends - starts, out=offsets[1:])
+        return buf[mask], other[mask] if other is not None else None, offsets
+
+    # boolean mask of the (disjoint) ranges [starts[i], ends[i]) in range(n)
+    @staticmethod
+    def mask(n: int, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        delta = np.zeros(n + 1, dtype=np.int8)
+        np.add.at(delta, starts, 1)
+        np.add.at(delta, ends, -1)
+        return np.cumsum(delta[:-1], dtype=np.int8).view(bool)
+
+    # parse FASTQ records in buf[start:end] (bytes or mmap); annotations
+    # in read names are kept as-is if not `parse_annot`
+    @staticmethod
+    def from_buffer(buf, start: int = 0, end: int = None, parse_annot: bool = True) -> "RecordBatch":
+        end = len(buf) if end is None else min(end, len(buf))
+        arr = np.frombuffer(buf, dtype=np.uint8, count=end - start, offset=start)
+
+        # line breaks (the last line may not end with one)
+        nl = np.flatnonzero(arr == 10)
+        if len(arr) and arr[-1] != 10:
+            nl = np.append(nl, len(arr))
+        nl = nl[:len(nl) // 4 * 4]
+        line_starts = np.zeros(len(nl), dtype=np.int64)
+        line_starts[1:] = nl[:-1] + 1
+        line_ends = nl.copy()
+        cr = line_ends > line_starts
+        cr[cr] = arr[line_ends[cr] - 1] == 13
+        line_ends -= cr
+
+        # columns (skip "@" and "+")
+        seq, qual, offsets = RecordBatch.gather(
+            arr, line_starts[1::4], line_ends[1::4], None
+        )
+        qual, _, qual_offsets = RecordBatch.gather(
+            arr, line_starts[3::4], line_ends[3::4]
+        )
+        if not np.array_equal(offsets, qual_offsets):
+            raise ValueError("Lengths of sequence and quality lines differ")
+        ids, _, id_offsets = RecordBatch.gather(
+            arr, line_starts[0::4] + 1, line_ends[0::4]
+        )
+        id2s, _, id2_offsets = RecordBatch.gather(
+            arr, np.minimum(line_starts[2::4] + 1, line_ends[2::4]), line_ends[2::4]
+        )
+        batch = RecordBatch(ids, id_offsets, seq, qual, offsets, id2s, id2_offsets)
+
+        # annotations in read names (from previous NanoPreP runs)
+        if parse_annot and ids.tobytes().find(b"strand=") >= 0:
+            batch.parse_annotations()
+        return batch
+
+    # move annotations in read names into the annotation columns
+    def parse_annotations(self) -> None:
+        names = []
+        for i in range(len(self)):
+            name, annot = SeqAnnot.from_id(self.name(i))
+            self.set_annot(i, annot)
+            names.append(name.encode())
+        self.ids = np.frombuffer(b"".join(names), dtype=np.uint8)
+        np.cumsum([len(name) for name in names], out=self.id_offsets[1:])
+        return
@@ -3,8 +3,39 @@ from typing import Tuple
 import numpy as np
 import re
 
+# error probability of each quality character (Phred+33; byte -> 10^(-Q/10))
+PHRED_ERROR = np.power(10, (np.arange(256) - 33) / -10)
+
+# complement of IUPAC nucleotide codes (other characters are kept as-is)
+COMPLEMENT_STR = str.maketrans(
+    "ACGTUMRWSYKVHDBNacgtumrwsykvhdbn",
+    "TGCAAKYWSRMBDHVNtgcaakywsrmbdhvn"
+)
+COMPLEMENT_BYTES = bytes.maketrans(
+    b"ACGTUMRWSYKVHDBNacgtumrwsykvhdbn",
+    b"TGCAAKYWSRMBDHVNtgcaakywsrmbdhvn"
+)
+
+# annotation in read names (written by NanoPreP; see `SeqAnnot.__str__`)
+ANNOT_PATTERN = re.compile(
+    r"(?P<prefix>.*)"
+    r"strand=(?P<strand>-?\d+\.\d*) "
+    r"full_length=(?P<full_length>[01]) "
+    r"fusion=(?P<fusion>[01]) "
+    r"ploc5=(?P<ploc5>-?\d+) "
+    r"ploc3=(?P<ploc3>-?\d+) "
+    r"poly5=(?P<poly5>-?\d+) "
+    r"poly3=(?P<poly3>-?\d+)"
+    r"(?P<suffix>.*)"
+)
+
 class SeqAnnot(object):
     """Object to represent features (annotation) on NanoPreP-styled records"""
+    __slots__ = (
+        "strand", "orientation", "full_length", "fusion",
+        "ploc5", "ploc3", "poly5", "poly3"
+    )
+
     def __init__(
         self,
         strand: float = 0,
@@ -67,22 +98,29 @@ class SeqAnnot(object):
             self.poly3
         )
 
+    def __reduce__(self):
+        return SeqAnnot, self.astuple()
+
+    def astuple(self) -> tuple:
+        return (
+            self.strand,
+            self.orientation,
+            self.full_length,
+            self.fusion,
+            self.ploc5,
+            self.ploc3,
+            self.poly5,
+            self.poly3
+        )
+
     @staticmethod
     def from_id(x: str) -> Tuple[str, "SeqAnnot"]:
-        program = re.compile(
-            r"(?P<prefix>.*)"
-            r"strand=(?P<strand>-?\d+\.\d*) "
-            r"full_length=(?P<full_length>[01]) "
-            r"fusion=(?P<fusion>[01]) "
-            r"ploc5=(?P<ploc5>-?\d+) "
-            r"ploc3=(?P<ploc3>-?\d+) "
-            r"poly5=(?P<poly5>-?\d+) "
-            r"poly3=(?P<poly3>-?\d+)"
-            r"(?P<suffix>.*)"
-        )
+        # unannotated reads (e.g. basecaller output) never match
+        if "strand=" not in x:
+            return x, SeqAnnot()
 
-        # match `x` with `program`
-        res = program.match(x)
+        # match `x` with `ANNOT_PATTERN`
+        res = ANNOT_PATTERN.match(x)
         if res:
             return res.group("prefix") + res.group("suffix"), \
                 SeqAnnot(
@@ -101,6 +139,8 @@ class SeqAnnot(object):
 
 class SeqFastq(object):
     """Object to represent NanoPreP-styled FASTQ record"""
+    __slots__ = ("id", "seq", "id2", "_qual", "annot", "_meanq")
+
     def __init__(
         self,
         id: str = "",
@@ -132,16 +172,35 @@ class SeqFastq(object):
     def __len__(self) -> int:
         return len(self.seq)
 
+    # assigning `qual` (e.g. trimming) invalidates the cached mean Q-score
+    @property
+    def qual(self) -> str:
+        return self._qual
+
+    @qual.setter
+    def qual(self, value: str) -> None:
+        self._qual = value
+        self._meanq = None
+
+    def qual_bytes(self) -> bytes:
+        return self.qual.encode()
+
+    # pickled as a flat tuple (no attribute names, no nested SeqAnnot)
+    def __reduce__(self):
+        return SeqFastq.from_tuple, \
+            (self.id, self.seq, self.id2, self.qual) + self.annot.astuple()
+
+    @staticmethod
+    def from_tuple(id, seq, id2, qual, *annot) -> "SeqFastq":
+        return SeqFastq(id, seq, id2, qual, SeqAnnot(*annot))
+
     @staticmethod
     def reverse_complement_static(sequence:str) -> str:
-        base_complment = {
-            "A": "T", "T": "A",
-            "C": "G", "G": "C",
-            "N": "N"
-        }
-        return "".join(
-            [base_complment[i] for i in sequence[::-1]]
-        )
+        return sequence[::-1].translate(COMPLEMENT_STR)
+
+    @staticmethod
+    def reverse_complement_bytes(sequence: bytes) -> bytes:
+        return sequence[::-1].translate(COMPLEMENT_BYTES)
 
     def reverse_complement(self) -> None:
         # seq
@@ -177,10 +236,13 @@ class SeqFastq(object):
         return
 
     @staticmethod
-    def parse(id, seq, id2, qual) -> object:
+    def parse(id, seq, id2, qual, parse_annot: bool = True) -> object:
         # id
         id = id.lstrip("@").rstrip("\n")
-        id, annot = SeqAnnot.from_id(id)
+        if parse_annot:
+            id, annot = SeqAnnot.from_id(id)
+        else:
+            annot = SeqAnnot()
         # seq
         seq = seq.strip()
         # qual
@@ -189,15 +251,113 @@ class SeqFastq(object):
         id2 = id2.lstrip("+").rstrip("\n")
         return SeqFastq(id, seq, id2, qual, annot)
 
+    # mean Q-score (cached on the record until `qual` changes)
     @staticmethod
     def meanq(read) -> float:
-        if len(read) == 0:
+        if read._meanq is None:
+            read._meanq = SeqFastq.meanq_bytes(read.qual_bytes())
+        return read._meanq
+
+    @staticmethod
+    def meanq_bytes(qual: bytes) -> float:
+        if len(qual) == 0:
             return 0
-        # ascii -> dec
-        quals = [ord(i) - 33 for i in read.qual]
-        quals = np.fromiter(quals, dtype=int, count=len(quals))
-        # q -> p -> mean p
-        mean_p = np.mean(np.power(10, quals/-10))
+        # ascii -> p -> mean p
+        mean_p = np.mean(PHRED_ERROR[np.frombuffer(qual, dtype=np.uint8)])
         # mean p -> mean q
         mean_q = -10 * np.log10(mean_p)
         return mean_q
+
+
+class SeqFastqView(SeqFastq):
+    """Lazy view of a FASTQ record in a bytes-like buffer (e.g. mmap)
+
+    Fields are decoded from the buffer on first access only, and assigned
+    fields take precedence over the buffered ones. Views pickle as plain
+    `SeqFastq` objects, so the buffer never leaves the process.
+    """
+    __slots__ = ("_buf", "_offsets", "_id", "_seq", "_id2", "_annot")
+
+    def __init__(self, buf, offsets: Tuple[int, ...]) -> None:
+        self._buf = buf
+        self._offsets = offsets  # (start, end) of id, seq, id2 and qual
+        self._id = None
+        self._seq = None
+        self._id2 = None
+        self._qual = None
+        self._annot = None
+        self._meanq = None
+        pass
+
+    def __len__(self) -> int:
+        if self._seq is None:
+            return self._offsets[3] - self._offsets[2]
+        return len(self._seq)
+
+    def _field(self, i: int) -> str:
+        return self._raw(i).decode()
+
+    def _raw(self, i: int) -> bytes:
+        return self._buf[self._offsets[2 * i]:self._offsets[2 * i + 1]]
+
+    def qual_bytes(self) -> bytes:
+        return self._raw(3) if self._qual is None else self._qual.encode()
+
+    def _header(self) -> None:
+        id, annot = SeqAnnot.from_id(self._field(0))
+        if self._id is None:
+            self._id = id
+        if self._annot is None:
+            self._annot = annot
+        return
+
+    @property
+    def id(self) -> str:
+        if self._id is None:
+            self._header()
+        return self._id
+
+    @id.setter
+    def id(self, value: str) -> None:
+        self._id = value
+
+    @property
+    def annot(self) -> SeqAnnot:
+        if self._annot is None:
+            self._header()
+        return self._annot
+
+    @annot.setter
+    def annot(self, value: SeqAnnot) -> None:
+        self._annot = value
+
+    @property
+    def seq(self) -> str:
+        if self._seq is None:
+            self._seq = self._field(1)
+        return self._seq
+
+    @seq.setter
+    def seq(self, value: str) -> None:
+        self._seq = value
+
+    @property
+    def id2(self) -> str:
+        if self._id2 is None:
+            self._id2 = self._field(2)
+        return self._id2
+
+    @id2.setter
+    def id2(self, value: str) -> None:
+        self._id2 = value
+
+    @property
+    def qual(self) -> str:
+        if self._qual is None:
+            self._qual = self._field(3)
+        return self._qual
+
+    @qual.setter
+    def qual(self, value: str) -> None:
+        self._qual = value
+        self._meanq = None